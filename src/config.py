@@ -4,9 +4,92 @@ from dotenv import load_dotenv
 load_dotenv()
 
 DOCUMENT_PATH = os.getenv("DOCUMENT_PATH")
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
 API_KEY = os.getenv("API_KEY")
-OLLAMA_URL  = os.getenv("OLLAMA_URL")
+OLLAMA_URL  = os.getenv("OLLAMA_URL", "http://ollama:11434/")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:1b")
+# How long Ollama keeps the model loaded after a request, and the timeout of one request to it.
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "300"))
+# /generate_batch: maximum number of queries per request and of generations of one batch running at once.
+GENERATE_BATCH_MAX_QUERIES = int(os.getenv("GENERATE_BATCH_MAX_QUERIES", "500"))
+GENERATE_BATCH_CONCURRENCY = int(os.getenv("GENERATE_BATCH_CONCURRENCY", "4"))
+# /search: maximum offset + k of a search.
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "100"))
+# Startup: whether to load the model into Ollama during warm-up, and how often a failed warm-up step is retried.
+WARMUP_OLLAMA = os.getenv("WARMUP_OLLAMA", "true").lower() in ("1", "true", "yes")
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "10"))
+# LLM gateway: generations running at once, generations allowed to wait for a slot, and how long they may wait.
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "4"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+
+CHROMA_HOST = os.getenv("CHROMA_HOST", "chroma")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "my_collection")
+# "http" talks to the chroma container; "ephemeral" keeps an in-memory collection inside the API process (benchmarks).
+CHROMA_MODE = os.getenv("CHROMA_MODE", "http")
+
+# Local state (dedup index, caches, ...) lives here.
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+# Held (shared) by every running API worker, so offline tools can tell that the API is up.
+API_LOCK_PATH = os.getenv("API_LOCK_PATH", os.path.join(DATA_DIR, "api.lock"))
+CHUNK_INDEX_PATH = os.getenv("CHUNK_INDEX_PATH", os.path.join(DATA_DIR, "chunk_index.sqlite3"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(DATA_DIR, "embedding_cache.sqlite3"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+# Most recently used embeddings kept in memory in front of the SQLite cache.
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "2048"))
+
+# In-process mirror of the Chroma collection used to serve similarity searches locally.
+LOCAL_INDEX_ENABLED = os.getenv("LOCAL_INDEX_ENABLED", "false").lower() in ("1", "true", "yes")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", os.path.join(DATA_DIR, "local_index"))
+
+# Micro-batching of concurrent query embeddings and searches. Set QUERY_BATCH_MAX_SIZE to 1 to disable it.
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "16"))
+
+# Context packing: token budget of the retrieved context in the prompt, maximum (squared L2) distance of a
+# relevant chunk (empty to disable the threshold) and word-shingle overlap above which a chunk is a near-duplicate.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))
+RETRIEVAL_MAX_DISTANCE = os.getenv("RETRIEVAL_MAX_DISTANCE", "1.6")
+RETRIEVAL_MAX_DISTANCE = float(RETRIEVAL_MAX_DISTANCE) if RETRIEVAL_MAX_DISTANCE else None
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.9"))
+
+# Number of chunks embedded and written to Chroma at a time during ingestion.
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+
+# PDF text extraction in a process pool. Set PDF_PARSE_WORKERS to 0 to parse in the request thread with PyPDFLoader.
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+
+# Uploads are written to disk as they are received; larger files than MAX_UPLOAD_BYTES are refused (413).
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+# Limits of one /ingest_batch request: number of files and their total size (413 above it).
+INGEST_BATCH_MAX_FILES = int(os.getenv("INGEST_BATCH_MAX_FILES", "20"))
+INGEST_BATCH_MAX_BYTES = int(os.getenv("INGEST_BATCH_MAX_BYTES", str(500 * 1024 * 1024)))
+
+# Background ingestion jobs (/ingest?background=true).
+INGEST_JOBS_PATH = os.getenv("INGEST_JOBS_PATH", os.path.join(DATA_DIR, "ingest_jobs.sqlite3"))
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(DATA_DIR, "uploads"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "100"))
+
+# Answer cache for /generate. Set ANSWER_CACHE_SIMILARITY above 1 to only serve exact (normalized) matches.
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
 
 print(API_KEY)
 
+# Evaluation (rag/eval.py): generated answers and judge verdicts are cached here between runs.
+EVAL_CACHE_PATH = os.getenv("EVAL_CACHE_PATH", os.path.join(DATA_DIR, "eval_cache.sqlite3"))
+
+# Serving: number of uvicorn worker processes started by `python main.py`. With more than one worker,
+# the metrics behind /stats and /metrics are kept in a SQLite file shared by all of them.
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+METRICS_DB_PATH = os.getenv("METRICS_DB_PATH", os.path.join(DATA_DIR, "metrics.sqlite3"))
+# Seconds between two merges of a worker's counters into the shared metrics file.
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1.0"))
+# Collection snapshots (export/import without re-embedding): where they are written and how many chunks go in one upsert.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(DATA_DIR, "snapshots"))
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "5000"))
@@ -1,32 +1,151 @@
-from fastapi import FastAPI, Request, Response,UploadFile,HTTPException, Depends
+from fastapi import FastAPI, Request, Response,HTTPException, Depends
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from starlette.routing import Match
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 from rag.ingestion import DocumentIngestor
 from rag.retrivial import Retrivial
+from rag.batch_generation import BatchGenerator
+from rag.resources import SharedResources, create_metrics_registry, metadata_filter
+from rag.jobs import IngestJobQueue, QueueFull
+from rag.llm_gateway import GatewayBusy
+from rag.uploads import receive_uploads, UploadTooLarge, InvalidUpload
+from rag.snapshots import export_snapshot, import_snapshot, read_manifest, SnapshotError
 from fastapi.security import APIKeyHeader
-from config import API_KEY
-import logging,time
+from rag.metrics import series_key, SqliteMetricsStore
+from rag.file_lock import FileLock
+from config import API_KEY, INGEST_JOBS_PATH, UPLOAD_DIR, INGEST_WORKERS, INGEST_MAX_PENDING, API_WORKERS, METRICS_DB_PATH
+from config import MAX_UPLOAD_BYTES, INGEST_BATCH_MAX_FILES, INGEST_BATCH_MAX_BYTES, WARMUP_OLLAMA, WARMUP_RETRY_INTERVAL
+from config import GENERATE_BATCH_MAX_QUERIES, GENERATE_BATCH_CONCURRENCY, SEARCH_MAX_RESULTS
+from config import SNAPSHOT_DIR, SNAPSHOT_BATCH_SIZE, API_LOCK_PATH
+import logging,time,json,asyncio,os,re
 import uvicorn
 
-metrics = {
-    "total_requests": 0,
-    "total_success_requests": 0,
-    "total_failed_requests": 0,
-    "total_process_time": 0.0,
-    "ingest_requests": 0,
-    "generate_requests": 0,
-    "total_tokens_used": 0,
-}
+# Counters reported by /stats. They are kept in the metrics store of the shared resources as rag_<name>,
+# so with several API workers (API_WORKERS > 1) every worker adds to the same totals.
+COUNTERS = (
+    "total_requests",
+    "total_success_requests",
+    "total_failed_requests",
+    "total_process_time",
+    "ingest_requests",
+    "generate_requests",
+    "search_requests",
+    "total_tokens_used",
+    "prompt_tokens_saved",
+)
+
+def count(resources, name: str, value: float = 1):
+    """Increment one of the /stats counters."""
+    resources.metrics.inc(f"rag_{name}", value=value)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 API_KEY_NAME = "X-API-Key"
 api_key_header = APIKeyHeader(name=API_KEY_NAME,auto_error=False)
 
-async def verify_api_key(api_key: str = Depends(api_key_header)):
-    """A dependency to verify the API key in the request header."""
+async def verify_api_key(request: Request, api_key: str = Depends(api_key_header)):
+    """A dependency to verify the API key in the request header. Health probes do not need one."""
+    if request.url.path.startswith("/health/"):
+        return
     if api_key != API_KEY:
         raise HTTPException(status_code=403, detail="Invalid API Key")
 
+async def warm_up(app: FastAPI):
+    """
+    Build the shared resources and warm up every component (embedding model, tokenizer, Chroma, Ollama)
+    in the background, so the app answers health probes while it starts. A failing component is retried
+    every WARMUP_RETRY_INTERVAL seconds. The endpoints that do not need the LLM are served once the embedding
+    model, tokenizer and Chroma are up; the app reports ready once Ollama is warmed up too.
+    """
+    health = app.state.health
+
+    async def attempt(component: str, step):
+        while True:
+            started = time.perf_counter()
+            try:
+                result = await asyncio.to_thread(step)
+                health["components"][component] = {"status": "ok", "seconds": round(time.perf_counter() - started, 4)}
+                return result
+            except Exception as e:
+                logger.warning(f"Warm-up of {component} failed, retrying in {WARMUP_RETRY_INTERVAL}s: {e}")
+                health["components"][component] = {"status": "error", "error": str(e)}
+                await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+
+    # Offline tools (e.g. a snapshot import) hold this lock exclusively while they run.
+    await attempt("lock", lambda: app.state.api_lock.acquire(shared=True))
+    resources = await attempt("resources", lambda: SharedResources(app.state.metrics))
+    app.state.resources = resources
+    logger.info("Shared resources initialized.")
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    app.state.ingest_queue = IngestJobQueue(
+        resources,
+        INGEST_JOBS_PATH,
+        workers=INGEST_WORKERS,
+        max_pending=INGEST_MAX_PENDING,
+        on_complete=lambda filename, result: invalidate_answer_cache(resources, filename, result),
+    )
+    app.state.ingest_queue.resume()
+
+    for component, step in [("embedding", resources.warm_up_embedding), ("tokenizer", resources.warm_up_tokenizer), ("chroma", resources.warm_up_chroma)]:
+        await attempt(component, step)
+    health["retrieval_ready"] = True
+    app.state.retrieval_ready.set()
+    logger.info("Retrieval ready, serving the endpoints that do not need the LLM.")
+    if WARMUP_OLLAMA:
+        # Retried for as long as Ollama is down or still pulling the model; only the LLM endpoints wait for it.
+        await attempt("ollama", resources.warm_up_ollama)
+    # Time spent per component, including building it.
+    for component, seconds in resources.timings.items():
+        health["components"][component] = {"status": "ok", "seconds": round(seconds, 4)}
+    health["ready"] = True
+    app.state.ready.set()
+    logger.info(f"Warm-up done in {time.perf_counter() - health['started']:.2f}s.")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the shared embedding model, Chroma client and Ollama client once for the app's lifetime, without blocking startup."""
+    app.state.metrics = create_metrics_registry()
+    app.state.resources = None
+    app.state.ingest_queue = None
+    app.state.api_lock = FileLock(API_LOCK_PATH)
+    app.state.retrieval_ready = asyncio.Event()
+    app.state.ready = asyncio.Event()
+    app.state.health = {"ready": False, "retrieval_ready": False, "started": time.perf_counter(), "components": {}}
+    warm_up_task = asyncio.create_task(warm_up(app))
+    yield
+    warm_up_task.cancel()
+    if app.state.ingest_queue is not None:
+        app.state.ingest_queue.shutdown()
+    if app.state.resources is not None:
+        app.state.resources.close()
+    app.state.resources = None
+    app.state.api_lock.release()
+    app.state.metrics.close()
+
+def get_resources(request: Request) -> SharedResources:
+    """A dependency returning the process-wide shared resources, once the retrieval side is warmed up (see warm_up)."""
+    resources = request.app.state.resources
+    if resources is None or not request.app.state.retrieval_ready.is_set():
+        raise HTTPException(status_code=503, detail="The service is starting up.", headers={"Retry-After": "5"})
+    # Another worker may have changed the collection since this worker last looked.
+    resources.refresh_if_index_changed()
+    return resources
+
+def get_llm_resources(request: Request) -> SharedResources:
+    """Like get_resources, for the endpoints that generate: they also wait for the Ollama warm-up."""
+    resources = get_resources(request)
+    if not request.app.state.ready.is_set():
+        raise HTTPException(status_code=503, detail="The LLM is not ready yet.", headers={"Retry-After": "5"})
+    return resources
+
+def get_ingest_queue(request: Request) -> IngestJobQueue:
+    """A dependency returning the background ingestion queue."""
+    if request.app.state.ingest_queue is None or not request.app.state.retrieval_ready.is_set():
+        raise HTTPException(status_code=503, detail="The service is starting up.", headers={"Retry-After": "5"})
+    return request.app.state.ingest_queue
+
 app = FastAPI(
     title = "RAG QA",
     description=(
@@ -34,42 +153,105 @@ app = FastAPI(
         "Endpoints include document ingestion and question answering with context. "
         "Monitoring is implemented for token usage, response times, and success/failure rates."
     ),
-    dependencies=[Depends(verify_api_key)]
+    dependencies=[Depends(verify_api_key)],
+    lifespan=lifespan,
 )
 
 
+@app.exception_handler(GatewayBusy)
+async def gateway_busy_handler(request: Request, exc: GatewayBusy):
+    """Shed load when the LLM gateway cannot take another generation."""
+    logger.warning(f"Rejected generation: {exc}")
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
 class input_prompts(BaseModel):
     query: str 
+    # Only search the chunks of these files (one filename or a list).
+    source: str | list[str] | None = None
+
+class search_request(BaseModel):
+    query: str
+    k: int = 5
+    offset: int = 0
+    max_distance: float | None = None
+    source: str | list[str] | None = None
+    page: int | list[int] | None = None
+
+class batch_prompts(BaseModel):
+    queries: list[str]
 
 @app.middleware("http")
 async def metrics_middleware(request: Request, call_next):
-    """A middleware to track API metrics for each request."""
-    global metrics
-    metrics["total_requests"] += 1
+    """
+    A middleware to track API metrics for each request. The request is accounted for once the last chunk
+    of its body is sent, so streamed answers count their whole generation time and stay in flight until done.
+    """
     start_time = time.time()
 
-    response: Response = await call_next(request)
-    process_time = time.time() - start_time
-    metrics["total_process_time"] += process_time
+    # Per-endpoint latency histogram, in-flight gauge and status counters (see rag.metrics).
+    registry = request.app.state.metrics
+    endpoint = endpoint_label(request)
+    registry.inc("rag_http_in_flight", {"endpoint": endpoint})
 
-    # Update success/failure counts based on HTTP status.
-    if response.status_code < 400:
-        metrics["total_success_requests"] += 1
-    else:
-        metrics["total_failed_requests"] += 1
+    def finish(status: int):
+        process_time = time.time() - start_time
+        registry.observe("rag_http_request_duration_seconds", {"endpoint": endpoint}, process_time)
+        registry.store.inc_many({
+            series_key("rag_http_in_flight", {"endpoint": endpoint}): -1,
+            series_key("rag_http_requests_total", {"endpoint": endpoint, "status": str(status)}): 1,
+            "rag_total_requests": 1,
+            "rag_total_process_time": process_time,
+            # Update success/failure counts based on HTTP status.
+            "rag_total_success_requests" if status < 400 else "rag_total_failed_requests": 1,
+        })
+
+    try:
+        response: Response = await call_next(request)
+    except BaseException:
+        finish(500)
+        raise
 
-    response.headers["X-Process-Time"] = f"{process_time:.4f}"
+    async def body_then_finish(body_iterator):
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            finish(response.status_code)
+
+    response.body_iterator = body_then_finish(response.body_iterator)
+    # Time until the headers were ready; the full duration goes into the histogram.
+    response.headers["X-Process-Time"] = f"{time.time() - start_time:.4f}"
     return response
 
+def endpoint_label(request: Request) -> str:
+    """The route template of a request (e.g. /ingest/{job_id}), so that metric labels stay bounded."""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
 
+def invalidate_answer_cache(resources: SharedResources, filename: str, result: dict):
+    """
+    Drop the cached answers made stale by an ingestion. New chunks can change the retrieval of any
+    question, so adding chunks clears the whole cache; removing stale chunks only affects the answers
+    built from that file.
+    """
+    if result["added"]:
+        resources.answer_cache.invalidate()
+    elif result["removed"]:
+        resources.answer_cache.invalidate(filename)
+    if result["added"] or result["removed"]:
+        resources.mark_index_changed()
 
-@app.post("/ingest", summary = "Upload and ingest a document file (PDF or Markdown).",tags=["Document Ingestion"])
-async def ingest(document: UploadFile):
-    """Ingest a document file (PDF or Markdown) by uploading it to the API."""
+def validate_upload(filename: str, content_type: str):
+    """
+    Validate the filename, extension and MIME type of an uploaded document.
+    Returns: (filename, extension)
+    """
     # Validate filename
-    filename = document.filename
-    global metrics
-    metrics["ingest_requests"] += 1
     if not filename or '.' not in filename:
         raise HTTPException(status_code=400, detail="Invalid or missing filename.")
     
@@ -78,67 +260,394 @@ async def ingest(document: UploadFile):
 
     # Validate based on file extension and MIME type.
     if extension == "pdf":
-        if document.content_type != "application/pdf":
+        if content_type != "application/pdf":
             raise HTTPException(status_code=400, detail="Invalid MIME type for PDF file.")
     elif extension == "md":
-        if document.content_type not in ["text/markdown", "text/plain"]:
+        if content_type not in ["text/markdown", "text/plain"]:
             raise HTTPException(status_code=400, detail="Invalid MIME type for Markdown file.")
     else:
         raise HTTPException(
             status_code=400,
             detail="Unsupported file extension. Only PDF and Markdown files are allowed."
         )
+    return filename, extension
+
+def multipart_body(field: str, multiple: bool = False) -> dict:
+    """OpenAPI description of the file upload that an endpoint parses itself (see receive)."""
+    file_schema = {"type": "string", "format": "binary"}
+    schema = {"type": "array", "items": file_schema} if multiple else file_schema
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object", "properties": {field: schema}, "required": [field],
+    }}}}}
+
+async def receive(request: Request, field: str, max_request_bytes: int = None, max_files: int = None, max_total_bytes: int = None):
+    """
+    Stream the files of a multipart upload to UPLOAD_DIR as they arrive (see rag.uploads.receive_uploads),
+    validating each one before its content is read and refusing any file over MAX_UPLOAD_BYTES, more than
+    max_files files, or more than max_total_bytes in total.
+    Returns: list of SpooledUpload
+    """
+    content_length = request.headers.get("content-length")
+    if content_length is not None:
+        if not content_length.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid Content-Length header.")
+        if max_request_bytes and int(content_length) > max_request_bytes:
+            raise HTTPException(status_code=413, detail=f"Request is larger than {max_request_bytes} bytes.")
+    try:
+        uploads = await receive_uploads(
+            request, UPLOAD_DIR, {field}, MAX_UPLOAD_BYTES, validate=validate_upload,
+            max_files=max_files, max_total_bytes=max_total_bytes,
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not uploads:
+        raise HTTPException(status_code=400, detail=f"No file uploaded in the '{field}' field.")
+    return uploads
+
+@app.post("/ingest", summary = "Upload and ingest a document file (PDF or Markdown).",tags=["Document Ingestion"], openapi_extra=multipart_body("document"))
+async def ingest(
+    request: Request,
+    background: bool = False,
+    resources: SharedResources = Depends(get_resources),
+    ingest_queue: IngestJobQueue = Depends(get_ingest_queue),
+):
+    """
+    Ingest a document file (PDF or Markdown) by uploading it to the API.
+    With background=true the file is queued and a job id is returned straight away; poll /ingest/{job_id} for its state.
+    """
+    count(resources, "ingest_requests")
+    # The upload is written to disk as it is received and parsed from there, so memory does not grow with the file size.
+    # Some slack over the file limit for the multipart framing.
+    uploads = await receive(request, "document", max_request_bytes=MAX_UPLOAD_BYTES + 64 * 1024)
+    if len(uploads) > 1:
+        for upload in uploads:
+            os.remove(upload.path)
+        raise HTTPException(status_code=400, detail="Upload a single file; use /ingest_batch for several.")
+    upload = uploads[0]
+    filename, extension = validate_upload(upload.filename, upload.content_type)
+    file_path, content_hash = upload.path, upload.sha256
+    if resources.chunk_index.file_hash(filename) == content_hash:
+        os.remove(file_path)
+        logger.info(f"File '{filename}' is unchanged since its last ingestion.")
+        return {"detail": "File already ingested, nothing changed."}
+
+    if background:
+        # The spooled file survives a restart, so the job can be resumed.
+        try:
+            job_id = ingest_queue.submit(file_path, filename, extension)
+        except QueueFull as e:
+            os.remove(file_path)
+            logger.warning(f"Rejected ingestion of '{filename}': {e}")
+            raise HTTPException(status_code=503, detail="Too many pending ingestion jobs.", headers={"Retry-After": "30"})
+        logger.info(f"File '{filename}' queued for ingestion as job {job_id}.")
+        return JSONResponse(status_code=202, content={"detail": "File queued for ingestion.", "job_id": job_id})
 
     try:
-        # Read file content once.
-        file_content = await document.read()
-       
-        doc_ingestor = DocumentIngestor()
-        doc_ingestor.run_from_api(file_content, filename, extension)
+        doc_ingestor = DocumentIngestor(resources)
+        result = await asyncio.to_thread(doc_ingestor.run_from_path, file_path, filename, extension, None, content_hash)
+        invalidate_answer_cache(resources, filename, result)
         logger.info(f"File '{filename}' ingested successfully.")
     except Exception as e:
         logger.error(f"Error processing file '{filename}': {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to process document ingestion.")
+    finally:
+        os.remove(file_path)
 
     return {"detail": "File processed successfully."}
 
+@app.post("/ingest_batch", summary = "Upload and ingest several document files at once.",tags=["Document Ingestion"], openapi_extra=multipart_body("documents", multiple=True))
+async def ingest_batch(request: Request, resources: SharedResources = Depends(get_resources)):
+    """
+    Ingest several document files (PDF or Markdown) in one request. The files are parsed and embedded
+    concurrently; the result of every file is reported separately.
+    """
+    count(resources, "ingest_requests")
+    # Some slack over the total limit for the multipart framing of every file.
+    spooled = await receive(
+        request,
+        "documents",
+        max_request_bytes=INGEST_BATCH_MAX_BYTES + INGEST_BATCH_MAX_FILES * 64 * 1024,
+        max_files=INGEST_BATCH_MAX_FILES,
+        max_total_bytes=INGEST_BATCH_MAX_BYTES,
+    )
+    uploads = [
+        (upload.path, upload.sha256, *validate_upload(upload.filename, upload.content_type))
+        for upload in spooled
+    ]
+
+    async def ingest_one(file_path: str, content_hash: str, filename: str, extension: str):
+        try:
+            doc_ingestor = DocumentIngestor(resources)
+            result = await asyncio.to_thread(doc_ingestor.run_from_path, file_path, filename, extension, None, content_hash)
+        finally:
+            os.remove(file_path)
+        invalidate_answer_cache(resources, filename, result)
+        return result
+
+    results = await asyncio.gather(*(ingest_one(*upload) for upload in uploads), return_exceptions=True)
+    files = []
+    for (_, _, filename, _), result in zip(uploads, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error processing file '{filename}': {str(result)}")
+            files.append({"filename": filename, "detail": "Failed to process document ingestion."})
+        else:
+            logger.info(f"File '{filename}' ingested successfully.")
+            files.append({"filename": filename, "detail": "File processed successfully.", "stats": result})
+    return {"files": files}
+
+@app.get("/ingest/{job_id}", summary = "Get the state of a background ingestion job",tags=["Document Ingestion"])
+async def ingest_status(job_id: str, ingest_queue: IngestJobQueue = Depends(get_ingest_queue)):
+    """
+    Report the state of an ingestion job (queued, running, done or failed), the number of chunks
+    processed, added and skipped so far, and the seconds spent per ingestion stage.
+    """
+    job = await asyncio.to_thread(ingest_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown ingestion job.")
+    return job
+
+def record_token_usage(resources: SharedResources, endpoint: str, usage: dict):
+    """Add the prompt and completion tokens of one generation to the totals; answers given without the LLM cost nothing."""
+    if usage["source"] is None:
+        return
+    resources.tokens.record(endpoint, usage)
+    count(resources, "total_tokens_used", usage["prompt_tokens"] + usage["completion_tokens"])
+
+def search_filter(source=None, page=None) -> dict:
+    """The metadata filter of a request (see metadata_filter), answering 400 when it is invalid."""
+    try:
+        return metadata_filter(source, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/generate", summary = "Answer a question with context",tags=["Question Answering"])
-async def generate(input_prompts: input_prompts):
+async def generate(input_prompts: input_prompts, resources: SharedResources = Depends(get_llm_resources)):
     """
-    Generate a response to a question based on the provided context."""
+    Generate a response to a question based on the provided context.
+    With a source, only the chunks of those files are searched; such answers bypass the answer cache."""
     query = input_prompts.query
-    global metrics
-    metrics["generate_requests"] += 1
+    where = search_filter(source=input_prompts.source)
+    count(resources, "generate_requests")
     try: 
-        retrivier = Retrivial(query)
-        response_text,formatted_context,token_len = retrivier.run()
-        metrics["total_tokens_used"] += token_len
+        cached = None if where else resources.answer_cache.lookup_exact(query)
+        if cached is None:
+            retrivier = Retrivial(query, resources, where=where)
+            relevant_docs = await retrivier.afind_relevant_docs()
+            if not where:
+                # Near-duplicates are looked up with the embedding of the batched retrieval.
+                cached = await asyncio.to_thread(resources.answer_cache.lookup_similar, query, retrivier.query_embedding)
+        if cached is not None:
+            logger.info("Query served from the answer cache")
+            return {"query": query,"response": cached["response"],"sources(context)":cached["context"] ,"token_count": cached["token_count"], "prompt_tokens_saved": 0}
+
+        response_text,formatted_context,token_len = await retrivier.arun(relevant_docs)
+        record_token_usage(resources, "/generate", retrivier.usage)
+        prompt_tokens_saved = retrivier.packing_stats.get("tokens_saved", 0)
+        count(resources, "prompt_tokens_saved", prompt_tokens_saved)
+        if not where:
+            await asyncio.to_thread(resources.answer_cache.store, query, response_text, formatted_context, token_len, retrivier.sources, retrivier.query_embedding)
         logger.info("Query Processed Successfully")
+    except GatewayBusy:
+        raise
+    except Exception as e:
+        logger.error(f"Error in processing query: {str(e)}")
+        return {"response": "Error in processing query"}
+
+    return {"query": query,"response": response_text,"sources(context)":formatted_context ,"token_count": token_len, "prompt_tokens_saved": prompt_tokens_saved}
+
+def format_sse(event: str, data) -> str:
+    """Format a single Server-Sent Event with a JSON encoded payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/generate_stream", summary = "Answer a question with context, streamed as Server-Sent Events",tags=["Question Answering"])
+async def generate_stream(input_prompts: input_prompts, resources: SharedResources = Depends(get_llm_resources)):
+    """
+    Stream the answer to a question as Server-Sent Events. The retrieved sources are sent first
+    (event "sources"), then every LLM token as it is produced (event "token"), and finally the
+    token count (event "done"). Failures during generation are reported with an "error" event.
+    The source filter works as in /generate.
+    """
+    query = input_prompts.query
+    where = search_filter(source=input_prompts.source)
+    count(resources, "generate_requests")
+    retrivier = Retrivial(query, resources, where=where)
+
+    cached = None if where else resources.answer_cache.lookup_exact(query)
+    if cached is None:
+        # Only a full LLM queue is refused with a status (429); the slot itself is awaited once the
+        # sources are sent, so a busy LLM never delays them.
+        resources.gateway.check_queue()
+
+    async def event_stream():
+        nonlocal cached
+        try:
+            if cached is None:
+                relevant_docs = await retrivier.afind_relevant_docs()
+                if not where:
+                    cached = await asyncio.to_thread(resources.answer_cache.lookup_similar, query, retrivier.query_embedding)
+            if cached is not None:
+                logger.info("Query served from the answer cache")
+                yield format_sse("sources", cached["context"])
+                yield format_sse("token", cached["response"])
+                yield format_sse("done", {"token_count": cached["token_count"], "prompt_tokens_saved": 0})
+                return
+
+            retrieved = await retrivier.aretrieve(relevant_docs)
+            response_parts = []
+            async for event, data in retrivier.astream(retrieved):
+                if event == "sources":
+                    formatted_context = data
+                elif event == "token":
+                    response_parts.append(data)
+                elif event == "done":
+                    record_token_usage(resources, "/generate_stream", retrivier.usage)
+                    prompt_tokens_saved = retrivier.packing_stats.get("tokens_saved", 0)
+                    count(resources, "prompt_tokens_saved", prompt_tokens_saved)
+                    if not where:
+                        await asyncio.to_thread(resources.answer_cache.store, query, "".join(response_parts), formatted_context, data, retrivier.sources, retrivier.query_embedding)
+                    logger.info("Query Processed Successfully")
+                    data = {"token_count": data, "prompt_tokens_saved": prompt_tokens_saved}
+                yield format_sse(event, data)
+        except GatewayBusy as e:
+            # The response has started, so a queue timeout can only be reported in the stream.
+            logger.warning(f"Rejected generation: {e}")
+            yield format_sse("error", str(e))
+        except Exception as e:
+            logger.error(f"Error in processing query: {str(e)}")
+            yield format_sse("error", "Error in processing query")
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/search", summary = "Find the passages relevant to a question, without generating an answer",tags=["Question Answering"])
+async def search(search_request: search_request, resources: SharedResources = Depends(get_resources)):
+    """
+    Retrieval only: the chunks nearest to the query with their ids, metadata and distances (lower is closer),
+    without calling the LLM. The source and page filters are applied inside the vector search. Results are
+    paginated with k and offset; next_offset is null on the last page.
+    """
+    if search_request.k < 1 or search_request.offset < 0 or search_request.offset + search_request.k > SEARCH_MAX_RESULTS:
+        raise HTTPException(status_code=400, detail=f"k must be positive, offset non-negative and offset + k at most {SEARCH_MAX_RESULTS}.")
+    where = search_filter(search_request.source, search_request.page)
+    count(resources, "search_requests")
+    try:
+        retrivier = Retrivial(search_request.query, resources, where=where)
+        # One more than the page, to tell whether there is a next one.
+        retrivier.k = search_request.offset + search_request.k + 1
+        relevant_docs = await retrivier.afind_relevant_docs()
     except Exception as e:
         logger.error(f"Error in processing query: {str(e)}")
         return {"response": "Error in processing query"}
+    if search_request.max_distance is not None:
+        relevant_docs = [(doc, distance) for doc, distance in relevant_docs if distance <= search_request.max_distance]
+
+    end = search_request.offset + search_request.k
+    page = relevant_docs[search_request.offset:end]
+    has_more = len(relevant_docs) > end and end < SEARCH_MAX_RESULTS
+    return {
+        "query": search_request.query,
+        "results": [
+            {"id": doc.metadata.get("id"), "text": doc.page_content, "metadata": doc.metadata, "distance": distance}
+            for doc, distance in page
+        ],
+        "offset": search_request.offset,
+        "next_offset": end if has_more else None,
+    }
 
-    return {"query": query,"response": response_text,"sources(context)":formatted_context ,"token_count": token_len}
+@app.post("/generate_batch", summary = "Answer a list of questions, streamed as NDJSON",tags=["Question Answering"])
+async def generate_batch(batch_prompts: batch_prompts, resources: SharedResources = Depends(get_llm_resources)):
+    """
+    Answer many questions in one call. The questions are embedded and searched together, repeated questions
+    are answered once and at most GENERATE_BATCH_CONCURRENCY of them are in progress at a time. Every answer is
+    sent as one JSON line as soon as it is ready, with its position in the list as "index"; a question that
+    failed gets an "error" field instead of failing the whole batch.
+    """
+    queries = batch_prompts.queries
+    if not queries:
+        raise HTTPException(status_code=400, detail="No queries given.")
+    if len(queries) > GENERATE_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {GENERATE_BATCH_MAX_QUERIES} queries per batch.")
+    count(resources, "generate_requests", len(queries))
+
+    def on_answered(retrivier: Retrivial):
+        record_token_usage(resources, "/generate_batch", retrivier.usage)
+        count(resources, "prompt_tokens_saved", retrivier.packing_stats.get("tokens_saved", 0))
+
+    # No more generations than the gateway runs at once, so the batch never fills its queue.
+    concurrency = min(GENERATE_BATCH_CONCURRENCY, resources.gateway.max_in_flight)
+    generator = BatchGenerator(resources, concurrency=concurrency, on_answered=on_answered)
+
+    async def lines():
+        failed = 0
+        async for index, item in generator.run(queries):
+            if "error" in item:
+                failed += 1
+                logger.error(f"Error in processing query {index}: {item['error']}")
+            yield json.dumps({"index": index, **item}) + "\n"
+        logger.info(f"Batch of {len(queries)} queries processed, {failed} failed")
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/health/live", summary = "Liveness probe",tags=["Monitoring"])
+async def health_live():
+    """The process is up and serving requests (it may still be warming up)."""
+    return {"status": "alive"}
+
+@app.get("/health/ready", summary = "Readiness probe",tags=["Monitoring"])
+async def health_ready(request: Request):
+    """
+    Ready once the shared resources are built and the embedding model, tokenizer, Chroma and Ollama are warmed up;
+    503 before that. retrieval_ready tells whether the endpoints that do not need the LLM are already served.
+    Reports the status and warm-up time of every component.
+    """
+    health = request.app.state.health
+    content = {
+        "ready": health["ready"],
+        "retrieval_ready": health["retrieval_ready"],
+        "uptime": round(time.perf_counter() - health["started"], 4),
+        "components": health["components"],
+    }
+    return JSONResponse(status_code=200 if health["ready"] else 503, content=content)
 
 @app.get("/stats", summary = "Get system metrics",tags=["Monitoring"])
-async def get_metrics():
+async def get_metrics(resources: SharedResources = Depends(get_resources)):
     """
     Retrieve API metrics including total requests, success/failure counts,
     average response time, request counts per endpoint, and token usage.
     """
+    snapshot = resources.metrics.store.snapshot()
+    metrics = {name: snapshot.get(f"rag_{name}", 0) for name in COUNTERS}
     avg_process_time = (metrics["total_process_time"] / metrics["total_requests"]
                         if metrics["total_requests"] > 0 else 0.0)
     return {
-        "total_requests": metrics["total_requests"],
-        "total_success_requests": metrics["total_success_requests"],
-        "total_failed_requests": metrics["total_failed_requests"],
+        "total_requests": int(metrics["total_requests"]),
+        "total_success_requests": int(metrics["total_success_requests"]),
+        "total_failed_requests": int(metrics["total_failed_requests"]),
         "average_process_time": round(avg_process_time, 4),
-        "ingest_requests": metrics["ingest_requests"],
-        "generate_requests": metrics["generate_requests"],
-        "total_tokens_used": metrics["total_tokens_used"],
+        "ingest_requests": int(metrics["ingest_requests"]),
+        "generate_requests": int(metrics["generate_requests"]),
+        "search_requests": int(metrics["search_requests"]),
+        "total_tokens_used": int(metrics["total_tokens_used"]),
+        "prompt_tokens_saved": int(metrics["prompt_tokens_saved"]),
+        "workers": API_WORKERS,
+        "tokens": resources.tokens.stats(),
+        "embedding_cache": resources.embedding.stats(),
+        "answer_cache": resources.answer_cache.stats(),
+        "llm_gateway": resources.gateway.stats(),
+        "query_batching": resources.batcher.stats() if resources.batcher is not None else None,
+        "latency": resources.metrics.summary(),
     }
+@app.get("/metrics", summary = "Get system metrics in the Prometheus text format",tags=["Monitoring"], response_class=PlainTextResponse)
+async def get_prometheus_metrics(resources: SharedResources = Depends(get_resources)):
+    """
+    Export the per-stage and per-endpoint latency histograms, in-flight gauges and error counters,
+    together with the /stats counters, in the Prometheus text exposition format.
+    """
+    return PlainTextResponse(resources.metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.delete("/clear_database", summary = "Clear the Vectore Database",tags=["Document Ingestion"])
-async def delete_database():
+async def delete_database(resources: SharedResources = Depends(get_resources)):
     """
     Clear all vectors/documents from the vector store.
     
@@ -146,13 +655,70 @@ async def delete_database():
         A JSON response with the number of vectors deleted.
     """
     try:
-        doc_ingestor = DocumentIngestor()
+        doc_ingestor = DocumentIngestor(resources)
         num_deleted = doc_ingestor.clear_database()
+        resources.answer_cache.invalidate()
+        resources.mark_index_changed()
         logger.info(f"Deleted {num_deleted} vectors from the vector store.")
         return {"detail": f"Deleted {num_deleted} vectors from the database."}
     except Exception as e:
         logger.error(f"Error clearing database: {e}")
         raise HTTPException(status_code=500, detail="Failed to clear the database.")
 
+def snapshot_path(name: str) -> str:
+    """Path of a named snapshot in SNAPSHOT_DIR; names are restricted so they cannot point outside of it."""
+    if not re.fullmatch(r"[A-Za-z0-9][A-Za-z0-9._-]*", name) or name.endswith(".tmp"):
+        raise HTTPException(status_code=400, detail="Invalid snapshot name.")
+    return os.path.join(SNAPSHOT_DIR, name)
+
+@app.get("/admin/snapshots", summary = "List the snapshots of the vector collection",tags=["Administration"])
+async def list_snapshots():
+    """List the snapshots in SNAPSHOT_DIR with their manifests."""
+    snapshots = []
+    if os.path.isdir(SNAPSHOT_DIR):
+        for name in sorted(os.listdir(SNAPSHOT_DIR)):
+            try:
+                manifest = read_manifest(os.path.join(SNAPSHOT_DIR, name))
+            except SnapshotError:
+                continue
+            snapshots.append({"name": name, **{key: value for key, value in manifest.items() if key != "files"}})
+    return {"snapshots": snapshots}
+
+@app.post("/admin/snapshots/{name}", summary = "Export the vector collection to a snapshot",tags=["Administration"])
+async def create_snapshot(name: str, resources: SharedResources = Depends(get_resources)):
+    """
+    Write every chunk with its text, metadata and embedding (as float16) to SNAPSHOT_DIR/<name>,
+    so the collection can be restored or moved to another environment without re-embedding.
+    """
+    path = snapshot_path(name)
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    try:
+        manifest = await asyncio.to_thread(export_snapshot, resources, path)
+    except SnapshotError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info(f"Exported {manifest['count']} chunks to snapshot '{name}'")
+    return {"name": name, **{key: value for key, value in manifest.items() if key != "files"}}
+
+@app.post("/admin/snapshots/{name}/import", summary = "Load a snapshot into the vector collection",tags=["Administration"])
+async def restore_snapshot(name: str, resources: SharedResources = Depends(get_resources)):
+    """
+    Upsert the chunks of a snapshot into the collection with their stored embeddings. Refused with 409
+    when the snapshot was made with another embedding model than the one this service uses.
+    """
+    path = snapshot_path(name)
+    try:
+        result = await asyncio.to_thread(import_snapshot, resources, path, SNAPSHOT_BATCH_SIZE)
+    except SnapshotError as e:
+        raise HTTPException(status_code=404 if not os.path.isdir(path) else 409, detail=str(e))
+    resources.answer_cache.invalidate()
+    resources.mark_index_changed()
+    logger.info(f"Imported {result['imported']} chunks from snapshot '{name}'")
+    return {"name": name, **result}
+
 if __name__ == "__main__":
-    uvicorn.run("main:app",host="0.0.0.0", port =8001, reload = True)
\ No newline at end of file
+    if API_WORKERS > 1:
+        # Start the shared counters from zero; in-flight gauges of a previous run would otherwise never come down.
+        SqliteMetricsStore(METRICS_DB_PATH).clear()
+        uvicorn.run("main:app",host="0.0.0.0", port =8001, workers = API_WORKERS)
+    else:
+        uvicorn.run("main:app",host="0.0.0.0", port =8001, reload = True)
\ No newline at end of file
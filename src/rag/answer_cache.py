@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation so light variations share a cache entry."""
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
+class AnswerCache:
+    """
+    In-memory cache of generated answers placed in front of Retrivial.run().
+    A query is served from the cache on an exact match of its normalized text, or when the cosine similarity
+    of its embedding with a cached query reaches similarity_threshold. The API checks the exact match before
+    retrieval and the near-duplicates once the query was embedded with its batch (see rag.batcher). Entries expire after ttl seconds,
+    the least recently used ones are evicted above max_entries, and the cache is invalidated when the
+    collection changes. Hits and misses are counted in the metrics registry; the entries are private to the process.
+    """
+    def __init__(self, metrics, embedding, max_entries: int = 1000, ttl: float = 3600, similarity_threshold: float = 0.95):
+        self.metrics = metrics
+        self.embedding = embedding
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def embed(self, query: str, vector=None):
+        """Returns: the unit-length embedding of the query, computed unless the caller already has it."""
+        if vector is None:
+            vector = self.embedding.embed_query(query)
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def expire(self):
+        """Drop the entries older than the TTL. Must be called with the lock held."""
+        now = time.time()
+        for key in [key for key, entry in self.entries.items() if now - entry["created"] > self.ttl]:
+            del self.entries[key]
+
+    def lookup(self, query: str, vector=None):
+        """
+        Find a cached answer for the query, by exact match and then among the near-duplicates.
+        Args: vector : the query embedding when the caller already has it; otherwise it is computed here.
+        Returns: the cached entry (dict with "response", "context", "token_count" and "sources") or None.
+        """
+        entry = self.lookup_exact(query)
+        return entry if entry is not None else self.lookup_similar(query, vector)
+
+    def lookup_exact(self, query: str):
+        """
+        Find a cached answer for the normalized text of the query; cheap, nothing is embedded.
+        A miss is only counted by lookup_similar, which is expected to follow.
+        Returns: the cached entry or None.
+        """
+        key = normalize_query(query)
+        with self.lock:
+            self.expire()
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is not None:
+            self.metrics.inc("rag_answer_cache_hits_total")
+        return entry
+
+    def lookup_similar(self, query: str, vector=None):
+        """
+        Find a cached answer for a near-duplicate of the query.
+        Args: vector : the query embedding, e.g. from the batched retrieval; computed here when None.
+        Returns: the cached entry or None.
+        """
+        with self.lock:
+            near_duplicates_possible = self.similarity_threshold <= 1 and len(self.entries) > 0
+        if not near_duplicates_possible:
+            self.metrics.inc("rag_answer_cache_misses_total")
+            return None
+
+        vector = self.embed(query, vector)
+        entry = None
+        with self.lock:
+            keys = list(self.entries)
+            if keys:
+                matrix = np.stack([self.entries[k]["embedding"] for k in keys])
+                similarities = matrix @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    self.entries.move_to_end(keys[best])
+                    entry = self.entries[keys[best]]
+        self.metrics.inc("rag_answer_cache_hits_total" if entry is not None else "rag_answer_cache_misses_total")
+        return entry
+
+    def store(self, query: str, response: str, context: str, token_count: int, sources: list[str], vector=None):
+        """Cache a generated answer together with the sources it was built from (and the query embedding, when known)."""
+        key = normalize_query(query)
+        entry = {
+            "embedding": self.embed(query, vector),
+            "response": response,
+            "context": context,
+            "token_count": token_count,
+            "sources": set(sources),
+            "created": time.time(),
+        }
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, source: str = None):
+        """
+        Drop cached answers. With a source, only the answers built from that source are dropped;
+        without one, the whole cache is cleared.
+        """
+        with self.lock:
+            if source is None:
+                self.entries.clear()
+                return
+            for key in [key for key, entry in self.entries.items() if source in entry["sources"]]:
+                del self.entries[key]
+
+    def stats(self) -> dict:
+        return {
+            "hits": int(self.metrics.get("rag_answer_cache_hits_total")),
+            "misses": int(self.metrics.get("rag_answer_cache_misses_total")),
+            "entries": len(self.entries),
+        }
@@ -0,0 +1,95 @@
+import asyncio
+import itertools
+from rag.answer_cache import normalize_query
+from rag.retrivial import Retrivial
+
+
+class BatchGenerator:
+    """
+    Answers a list of questions together. The distinct queries are embedded with one encode call and searched
+    with one multi-query Chroma call and answers are looked up in the answer cache. The prompt embeds the
+    question, so identical prompts come from identical questions: queries that only differ in case, spacing or
+    trailing punctuation are answered once. At most `concurrency` queries of the batch are answered at a time
+    (cache lookup, prompt and generation), each generation still going through the LLM gateway.
+    """
+    def __init__(self, resources, concurrency: int = 4, on_answered=None):
+        self.resources = resources
+        self.concurrency = concurrency
+        # Called with the Retrivial of every query answered without the cache, e.g. to record its token usage.
+        self.on_answered = on_answered
+
+    async def answer(self, query: str, relevant_docs, query_embedding) -> dict:
+        """
+        Answer one distinct query from its retrieved documents and its embedding (for the answer cache).
+        Returns: the result item, with an "error" instead of the response when it failed.
+        """
+        try:
+            cached = await asyncio.to_thread(self.resources.answer_cache.lookup, query, query_embedding)
+            if cached is not None:
+                return {"query": query, "response": cached["response"], "sources(context)": cached["context"],
+                        "token_count": cached["token_count"], "prompt_tokens_saved": 0, "cached": True}
+
+            retrivier = Retrivial(query, self.resources)
+            prompt_formated, formatted_context = await asyncio.to_thread(retrivier.build_prompt, relevant_docs)
+            if prompt_formated is None:
+                response_text, token_len = retrivier.skip_generation(), 0
+            else:
+                response_text = await retrivier.agenerate_response(prompt_formated)
+                token_len = retrivier.usage["completion_tokens"]
+            if self.on_answered is not None:
+                self.on_answered(retrivier)
+            await asyncio.to_thread(
+                self.resources.answer_cache.store, query, response_text, formatted_context, token_len, retrivier.sources,
+                query_embedding,
+            )
+            return {"query": query, "response": response_text, "sources(context)": formatted_context,
+                    "token_count": token_len, "prompt_tokens_saved": retrivier.packing_stats.get("tokens_saved", 0),
+                    "cached": False}
+        except Exception as e:
+            return {"query": query, "error": str(e) or type(e).__name__}
+
+    async def run(self, queries: list[str], k: int = 5):
+        """
+        Answer every query, in the order the answers complete.
+        Yields: (index, item) for every position of the queries list; a query that appears several
+        times is answered once and yielded for each of its positions.
+        """
+        positions = {}
+        distinct = []
+        for index, query in enumerate(queries):
+            key = normalize_query(query)
+            if key not in positions:
+                positions[key] = []
+                distinct.append(query)
+            positions[key].append(index)
+        if len(distinct) < len(queries):
+            self.resources.metrics.inc("rag_generate_batch_deduplicated_total", value=len(queries) - len(distinct))
+
+        try:
+            results, embeddings = await asyncio.to_thread(
+                self.resources.embed_and_search, distinct, k, return_embeddings=True
+            )
+        except Exception as e:
+            for index, query in enumerate(queries):
+                yield index, {"query": query, "error": str(e) or type(e).__name__}
+            return
+
+        # Tasks are started as earlier ones finish, so a large batch never has more than `concurrency`
+        # queries in progress nor more generations waiting on the gateway.
+        waiting = iter(zip(distinct, results, embeddings))
+        running = set()
+        try:
+            while True:
+                for query, docs, embedding in itertools.islice(waiting, self.concurrency - len(running)):
+                    running.add(asyncio.ensure_future(self.answer(query, docs, embedding)))
+                if not running:
+                    return
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    item = task.result()
+                    for index in positions[normalize_query(item["query"])]:
+                        yield index, {**item, "query": queries[index]}
+        finally:
+            # The client went away before the batch finished.
+            for task in running:
+                task.cancel()
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+from rag.metrics import parse_series_key
+
+
+class QueryBatcher:
+    """
+    Micro-batcher for query retrieval. Queries that arrive within window seconds of each other (or until
+    max_batch_size of them are waiting) are embedded in one encode call and searched with one multi-query
+    Chroma call per metadata filter; every caller then gets its own results back. Batches are counted in
+    the metrics registry, per batch size.
+    """
+    def __init__(self, resources, window: float = 0.005, max_batch_size: int = 16):
+        self.resources = resources
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+
+    async def search(self, query: str, k: int = 5, where: dict = None):
+        """
+        Queue a query for the next batch and wait for its results.
+        Returns: (list of (Document, distance) tuples nearest first, the query embedding).
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((query, k, where, future, time.perf_counter()))
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        """Dispatch the waiting queries as one batch."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        now = time.perf_counter()
+        metrics = self.resources.metrics
+        metrics.inc("rag_query_batches_total", {"size": len(batch)})
+        metrics.inc("rag_query_batch_wait_seconds_total", value=sum(now - queued_at for *_, queued_at in batch))
+
+        # A Chroma query applies one filter to all its query embeddings, so queries are grouped by filter.
+        groups = {}
+        for item in batch:
+            groups.setdefault(json.dumps(item[2], sort_keys=True), []).append(item)
+        for group in groups.values():
+            task = asyncio.create_task(self.run_batch(group))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run_batch(self, batch):
+        queries = [query for query, *_ in batch]
+        where = batch[0][2]
+        # Every query of the batch is searched with the largest k and trimmed to its own k afterwards.
+        max_k = max(k for _, k, *_ in batch)
+        try:
+            results, embeddings = await asyncio.to_thread(
+                self.resources.embed_and_search, queries, max_k, where, return_embeddings=True
+            )
+        except Exception as e:
+            for _, _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, k, _, future, _), result, embedding in zip(batch, results, embeddings):
+            if not future.done():
+                future.set_result((result[:k], embedding))
+
+    def stats(self) -> dict:
+        """Returns: the batching totals of every API worker."""
+        snapshot = self.resources.metrics.store.snapshot()
+        sizes = {}
+        for key, value in snapshot.items():
+            name, labels = parse_series_key(key)
+            if name == "rag_query_batches_total":
+                sizes[int(labels["size"])] = value
+        batches = sum(sizes.values())
+        queries = sum(size * count for size, count in sizes.items())
+        total_wait = snapshot.get("rag_query_batch_wait_seconds_total", 0.0)
+        return {
+            "batches": int(batches),
+            "queries": int(queries),
+            "avg_batch_size": round(queries / batches, 2) if batches else 0.0,
+            "max_batch_size": max(sizes, default=0),
+            "avg_wait_ms": round(1000 * total_wait / queries, 2) if queries else 0.0,
+        }
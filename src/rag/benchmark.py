@@ -0,0 +1,345 @@
+"""
+Offline load test of the API. The FastAPI app runs in-process against an ephemeral Chroma collection
+and a fake Ollama server (see rag.fake_ollama), and /ingest and /generate are driven at several
+concurrency levels with the bundled test.pdf and synthetic corpora of increasing size.
+
+Run from src:
+    python -m rag.benchmark --concurrency 1,8 --corpus-sizes 20,100 --output bench.json
+    python -m rag.benchmark --compare bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from rag.fake_ollama import FakeOllamaServer
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_PDF = os.path.join(SRC_DIR, "test.pdf")
+API_KEY = "benchmark"
+
+
+def read_rss(pid: str = "self") -> int:
+    """Resident memory of a process and its children in bytes, from /proc."""
+    with open(f"/proc/{pid}/statm") as f:
+        rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    task_dir = f"/proc/{pid}/task"
+    for task in os.listdir(task_dir):
+        with open(os.path.join(task_dir, task, "children")) as f:
+            for child in f.read().split():
+                try:
+                    rss += read_rss(child)
+                except OSError:
+                    pass
+    return rss
+
+
+class RssSampler:
+    """Samples the resident memory of the benchmark process (and its PDF parsing workers) to find the peak of a phase."""
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        try:
+            self.peak = max(self.peak, read_rss())
+        except OSError:
+            # No /proc (e.g. macOS): fall back to the peak of the whole process so far.
+            scale = 1 if sys.platform == "darwin" else 1024
+            self.peak = max(self.peak, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def latency_summary(latencies: list) -> dict:
+    return {
+        "avg": round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+        "p50": round(percentile(latencies, 0.50), 4),
+        "p99": round(percentile(latencies, 0.99), 4),
+        "max": round(max(latencies, default=0.0), 4),
+    }
+
+
+def synthetic_vocabulary(rng: random.Random, size: int = 2000) -> list[str]:
+    syllables = ["ka", "lo", "mi", "ra", "tes", "vun", "dor", "pel", "si", "gra", "ton", "bex", "quo", "ny", "fal"]
+    return ["".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(size)]
+
+
+def synthetic_pdf(pages: list[list[str]]) -> bytes:
+    """Build a minimal PDF (Helvetica text, one line per entry) so the synthetic corpora go through the real PDF path."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        escaped = (line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines)
+        stream = "BT /F1 10 Tf 12 TL 50 780 Td " + " ".join(f"({line}) '" for line in escaped) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def synthetic_corpus(rng: random.Random, vocabulary: list[str], pages: int, pages_per_doc: int):
+    """
+    Yields: (filename, PDF bytes) tuples covering `pages` pages of random sentences.
+    """
+    for doc in range(0, pages, pages_per_doc):
+        doc_pages = [
+            [" ".join(rng.choice(vocabulary) for _ in range(12)) + "." for _ in range(50)]
+            for _ in range(min(pages_per_doc, pages - doc))
+        ]
+        yield f"synthetic-{rng.getrandbits(32):08x}.pdf", synthetic_pdf(doc_pages)
+
+
+class Benchmark:
+    """Runs the benchmark phases against the in-process app and collects one result per phase."""
+    def __init__(self, app, client, args):
+        self.app = app
+        self.client = client
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.vocabulary = synthetic_vocabulary(self.rng)
+        self.phases = []
+
+    @property
+    def resources(self):
+        return self.app.state.resources
+
+    async def ingest(self, filename: str, content: bytes) -> bool:
+        response = await self.client.post("/ingest", files={"document": (filename, content, "application/pdf")})
+        return response.status_code < 400
+
+    async def generate(self, query: str) -> bool:
+        response = await self.client.post("/generate", json={"query": query})
+        # /generate reports failures in the body with a 200 status.
+        return response.status_code < 400 and "query" in response.json()
+
+    def stage_summary(self) -> dict:
+        """Per-stage latencies of the phase, from the app's own histograms (see rag.metrics)."""
+        from rag.metrics import parse_series_key
+        stages = {}
+        for key, summary in self.resources.metrics.summary().items():
+            name, labels = parse_series_key(key)
+            if name == "rag_stage_duration_seconds":
+                stages[f"{labels['pipeline']}.{labels['stage']}"] = summary
+        return stages
+
+    async def run_phase(self, name: str, jobs: list, concurrency: int) -> dict:
+        """
+        Run the jobs (coroutine factories returning success) with `concurrency` requests in flight.
+        Returns: the phase result, also appended to self.phases.
+        """
+        self.resources.metrics.store.clear()
+        pending = iter(jobs)
+        latencies, errors = [], 0
+
+        async def worker():
+            nonlocal errors
+            for job in pending:
+                started = time.perf_counter()
+                try:
+                    ok = await job()
+                except Exception:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                errors += not ok
+
+        started = time.perf_counter()
+        with RssSampler() as sampler:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        duration = time.perf_counter() - started
+
+        result = {
+            "name": name,
+            "concurrency": concurrency,
+            "requests": len(latencies),
+            "errors": errors,
+            "duration_s": round(duration, 4),
+            "throughput_rps": round(len(latencies) / duration, 4) if duration else 0.0,
+            "latency_s": latency_summary(latencies),
+            "peak_rss_mb": round(sampler.peak / 2**20, 1),
+            "chunks_in_collection": self.resources.collection.count(),
+            "stages": self.stage_summary(),
+        }
+        print(
+            f"{name:<32} c={concurrency:<3} n={result['requests']:<4} err={errors:<3} "
+            f"{result['throughput_rps']:>8.2f} req/s  p50={result['latency_s']['p50']:.3f}s  "
+            f"p99={result['latency_s']['p99']:.3f}s  rss={result['peak_rss_mb']}MB"
+        )
+        self.phases.append(result)
+        return result
+
+    async def run(self):
+        with open(TEST_PDF, "rb") as f:
+            test_pdf = f.read()
+        await self.run_phase("ingest:test.pdf", [lambda: self.ingest("test.pdf", test_pdf)], 1)
+        await self.run_generate_phases("test.pdf")
+
+        for pages in self.args.corpus_sizes:
+            for concurrency in self.args.concurrency:
+                # A fresh corpus per phase, so every phase embeds and writes new chunks.
+                corpus = list(synthetic_corpus(self.rng, self.vocabulary, pages, self.args.pages_per_doc))
+                jobs = [lambda filename=filename, content=content: self.ingest(filename, content) for filename, content in corpus]
+                await self.run_phase(f"ingest:synthetic-{pages}p", jobs, concurrency)
+            await self.run_generate_phases(f"synthetic-{pages}p")
+
+    async def run_generate_phases(self, corpus: str):
+        for concurrency in self.args.concurrency:
+            queries = [
+                f"What does the document say about {' '.join(self.rng.choice(self.vocabulary) for _ in range(3))}?"
+                for _ in range(self.args.queries)
+            ]
+            jobs = [lambda query=query: self.generate(query) for query in queries]
+            await self.run_phase(f"generate:{corpus}", jobs, concurrency)
+
+
+def compare(baseline_path: str, phases: list, threshold: float) -> bool:
+    """
+    Print how each phase moved against a previous run.
+    Returns: True when a phase lost more than `threshold` (relative) of its throughput or gained as much p99 latency.
+    """
+    with open(baseline_path) as f:
+        baseline = {(phase["name"], phase["concurrency"]): phase for phase in json.load(f)["phases"]}
+    regressed = False
+    print(f"\nCompared with {baseline_path}:")
+    for phase in phases:
+        old = baseline.get((phase["name"], phase["concurrency"]))
+        if old is None:
+            continue
+        throughput = phase["throughput_rps"] / old["throughput_rps"] - 1 if old["throughput_rps"] else 0.0
+        p99 = phase["latency_s"]["p99"] / old["latency_s"]["p99"] - 1 if old["latency_s"]["p99"] else 0.0
+        flag = throughput < -threshold or p99 > threshold
+        regressed |= flag
+        print(
+            f"{phase['name']:<32} c={phase['concurrency']:<3} throughput {throughput:+7.1%}  p99 {p99:+7.1%}"
+            + ("  REGRESSION" if flag else "")
+        )
+    return regressed
+
+
+async def run_benchmark(args) -> dict:
+    # Imported here: config reads the environment prepared by main() at import time.
+    import httpx
+    from main import app
+
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        # The app warms up in the background; startup is the time until /health/ready would answer 200.
+        await app.state.ready.wait()
+        startup = time.perf_counter() - started
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", headers={"X-API-Key": API_KEY}, timeout=None) as client:
+            benchmark = Benchmark(app, client, args)
+            await benchmark.run()
+    return {"startup_s": round(startup, 4), "phases": benchmark.phases}
+
+
+def parse_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput/latency benchmark of the RAG API.")
+    parser.add_argument("--concurrency", type=parse_list, default=[1, 8], help="comma-separated concurrency levels")
+    parser.add_argument("--corpus-sizes", type=parse_list, default=[20, 100], help="comma-separated synthetic corpus sizes, in pages")
+    parser.add_argument("--pages-per-doc", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=32, help="queries per /generate phase")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="generation speed of the fake Ollama")
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="seconds before the fake Ollama's first token")
+    parser.add_argument("--response-tokens", type=int, default=64, help="tokens per fake Ollama answer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    parser.add_argument("--compare", help="previous result file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    fake_ollama = FakeOllamaServer(
+        tokens_per_second=args.tokens_per_second,
+        first_token_latency=args.first_token_latency,
+        response_tokens=args.response_tokens,
+    ).start()
+    data_dir = tempfile.mkdtemp(prefix="rag-benchmark-")
+    # Point the app at the stand-ins and at a throw-away data directory before config is imported.
+    os.environ.update({
+        "API_KEY": API_KEY,
+        "CHROMA_MODE": "ephemeral",
+        "OLLAMA_URL": fake_ollama.url,
+        "DATA_DIR": data_dir,
+        "API_WORKERS": "1",
+        # Every query is distinct anyway; this keeps cached answers from hiding the pipeline.
+        "ANSWER_CACHE_MAX_ENTRIES": "0",
+    })
+    # Paths set explicitly (e.g. in .env) would otherwise still point at the real data.
+    for name, path in (
+        ("CHUNK_INDEX_PATH", "chunk_index.sqlite3"),
+        ("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3"),
+        ("LOCAL_INDEX_DIR", "local_index"),
+        ("INGEST_JOBS_PATH", "ingest_jobs.sqlite3"),
+        ("UPLOAD_DIR", "uploads"),
+        ("METRICS_DB_PATH", "metrics.sqlite3"),
+    ):
+        os.environ[name] = os.path.join(data_dir, path)
+
+    try:
+        results = asyncio.run(run_benchmark(args))
+    finally:
+        fake_ollama.stop()
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        **results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare and compare(args.compare, results["phases"], args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
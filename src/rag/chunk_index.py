@@ -0,0 +1,96 @@
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkIndex:
+    """
+    Local SQLite index of the chunk ids stored in the vector store. It answers "is this chunk already stored?"
+    for only the candidate ids of an upload, so deduplication cost grows with the upload and not with the collection.
+    Chroma stays the source of truth; the index is rebuilt from it whenever the two disagree.
+    """
+    # SQLite limits the number of host parameters per statement, so lookups are done in slices.
+    QUERY_BATCH_SIZE = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, source TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source)")
+        # Content hash of the last successfully ingested version of every source, to skip identical re-uploads.
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files (source TEXT PRIMARY KEY, sha256 TEXT)")
+        self.conn.commit()
+
+    def existing(self, ids: list[str]) -> set[str]:
+        """Return the subset of the given ids that is already stored."""
+        found = set()
+        with self.lock:
+            for start in range(0, len(ids), self.QUERY_BATCH_SIZE):
+                batch = ids[start:start + self.QUERY_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(f"SELECT id FROM chunks WHERE id IN ({placeholders})", batch)
+                found.update(row[0] for row in rows)
+        return found
+
+    def add(self, ids: list[str], sources: list[str]):
+        """Record chunk ids (and the source they belong to) as stored."""
+        with self.lock:
+            self.conn.executemany("INSERT OR IGNORE INTO chunks (id, source) VALUES (?, ?)", zip(ids, sources))
+            self.conn.commit()
+
+    def remove(self, ids: list[str]):
+        """Forget the given chunk ids."""
+        with self.lock:
+            self.conn.executemany("DELETE FROM chunks WHERE id = ?", ((chunk_id,) for chunk_id in ids))
+            self.conn.commit()
+
+    def ids_for_source(self, source: str) -> set[str]:
+        """Return every stored chunk id that belongs to the given source."""
+        with self.lock:
+            rows = self.conn.execute("SELECT id FROM chunks WHERE source = ?", (source,))
+            return {row[0] for row in rows}
+
+    def file_hash(self, source: str):
+        """Return the content hash of the last ingested version of a source, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT sha256 FROM files WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else None
+
+    def set_file_hash(self, source: str, sha256: str):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO files (source, sha256) VALUES (?, ?)", (source, sha256))
+            self.conn.commit()
+
+    def file_hashes(self) -> dict:
+        """Return the content hash of every ingested source."""
+        with self.lock:
+            return dict(self.conn.execute("SELECT source, sha256 FROM files"))
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM chunks")
+            self.conn.execute("DELETE FROM files")
+            self.conn.commit()
+
+    def sync_from_collection(self, collection, page_size: int = 1000):
+        """
+        Rebuild the index from the Chroma collection when their sizes disagree (first start, or the
+        collection was changed outside this service). A no-op when they are already in sync.
+        """
+        total = collection.count()
+        if total == self.count():
+            return
+        logger.info(f"Rebuilding chunk index from {total} stored chunks")
+        self.clear()
+        for offset in range(0, total, page_size):
+            page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            sources = [(metadata or {}).get("source") for metadata in page["metadatas"]]
+            self.add(page["ids"], sources)
@@ -0,0 +1,84 @@
+def shingles(text: str, size: int = 5) -> set:
+    """Word n-grams of a text, used to detect near-duplicate chunks."""
+    words = text.lower().split()
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def overlap_length(previous: str, following: str, min_overlap: int, max_overlap: int) -> int:
+    """Length of the longest suffix of `previous` that is also a prefix of `following` (0 when shorter than min_overlap)."""
+    for length in range(min(len(previous), len(following), max_overlap), min_overlap - 1, -1):
+        if previous.endswith(following[:length]):
+            return length
+    return 0
+
+
+class ContextPacker:
+    """
+    Packs retrieved chunks into the prompt context. Chunks above the distance threshold are dropped,
+    the rest are ordered by score, near-duplicates are removed and the text a chunk shares with an
+    already kept neighbour (the splitter's chunk_overlap) is trimmed. Chunks are then added until the
+    token budget is used up.
+    """
+    def __init__(self, count_tokens, token_budget: int = 1000, max_distance: float = None,
+                 duplicate_threshold: float = 0.9, min_overlap: int = 20, max_overlap: int = 200):
+        self.count_tokens = count_tokens
+        self.token_budget = token_budget
+        self.max_distance = max_distance
+        self.duplicate_threshold = duplicate_threshold
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+
+    def is_duplicate(self, candidate: set, kept: list) -> bool:
+        """A chunk is a near-duplicate when most of its shingles already appear in a kept chunk."""
+        return any(len(candidate & other) / len(candidate) >= self.duplicate_threshold for other in kept)
+
+    def trim_overlap(self, content: str, kept_docs: list) -> str:
+        """Remove the text that a chunk shares with the start or the end of a kept chunk."""
+        for doc, _ in kept_docs:
+            length = overlap_length(doc.page_content, content, self.min_overlap, self.max_overlap)
+            if length:
+                content = content[length:]
+            length = overlap_length(content, doc.page_content, self.min_overlap, self.max_overlap)
+            if length:
+                content = content[:-length]
+        return content.strip()
+
+    def pack(self, docs: list, format_doc=lambda doc: doc.page_content):
+        """
+        Args:
+            docs: list of (Document, distance) tuples as returned by the similarity search.
+            format_doc: how a chunk is rendered in the prompt, used to measure its tokens.
+        Returns: (packed list of (Document, distance) tuples, stats dict with the tokens before and after packing)
+        """
+        tokens_before = sum(self.count_tokens(format_doc(doc)) for doc, _ in docs)
+        candidates = sorted(docs, key=lambda item: item[1])
+        if self.max_distance is not None:
+            candidates = [(doc, score) for doc, score in candidates if score <= self.max_distance]
+
+        from langchain.schema.document import Document
+        packed, kept_shingles, used_tokens = [], [], 0
+        for doc, score in candidates:
+            content = self.trim_overlap(doc.page_content, packed)
+            if not content:
+                continue
+            candidate_shingles = shingles(content)
+            if self.is_duplicate(candidate_shingles, kept_shingles):
+                continue
+            packed_doc = Document(page_content=content, metadata=doc.metadata)
+            tokens = self.count_tokens(format_doc(packed_doc))
+            if used_tokens + tokens > self.token_budget:
+                continue
+            packed.append((packed_doc, score))
+            kept_shingles.append(candidate_shingles)
+            used_tokens += tokens
+
+        stats = {
+            "candidates": len(docs),
+            "kept": len(packed),
+            "tokens_before": tokens_before,
+            "tokens_after": used_tokens,
+            "tokens_saved": tokens_before - used_tokens,
+        }
+        return packed, stats
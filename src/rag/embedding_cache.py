@@ -0,0 +1,158 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so that trivially different copies of a text share a cache entry."""
+    return " ".join(text.split())
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Disk-backed, size-bounded embedding cache that wraps an embedding model.
+    Entries are keyed by the model name plus a hash of the normalized text and evicted least recently used first,
+    so re-uploaded documents, boilerplate pages shared between manuals and repeated queries are encoded only once.
+    The memory_entries most recently used vectors are also kept in memory, so a repeated query is served without
+    touching SQLite. Their last_used updates are deferred and written with the next store (or every touch_batch
+    hits), so reads never commit on their own. Hits and misses are counted in the metrics registry.
+    """
+    def __init__(self, metrics, embedding: Embeddings, model_name: str, path: str, max_entries: int = 100_000,
+                 memory_entries: int = 2048, touch_batch: int = 256):
+        self.metrics = metrics
+        self.embedding = embedding
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.touch_batch = touch_batch
+        self.lock = threading.Lock()
+        # key -> vector of the most recently used entries.
+        self.memory = OrderedDict()
+        # key -> time of use, for the hits whose last_used is not written yet.
+        self.touched = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # WAL stays consistent without an fsync per commit; a crash can only lose the latest cache entries.
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, last_used REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.conn.commit()
+        self.entries = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def cache_key(self, text: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{digest}"
+
+    def remember(self, key: str, vector: list[float]):
+        """Keep a vector in the in-memory LRU. Must be called with the lock held."""
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def write_touches(self):
+        """Write the deferred last_used updates, without committing. Must be called with the lock held."""
+        if self.touched:
+            self.conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", ((now, key) for key, now in self.touched.items()))
+            self.touched = {}
+
+    def lookup(self, keys: list[str]) -> dict:
+        """Return the cached vectors of the given keys and mark them as recently used."""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        now = time.time()
+        with self.lock:
+            on_disk = []
+            for key in unique_keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+                else:
+                    on_disk.append(key)
+            for start in range(0, len(on_disk), 500):
+                batch = on_disk[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+                    self.remember(key, found[key])
+            self.touched.update((key, now) for key in found)
+            if len(self.touched) >= self.touch_batch:
+                self.write_touches()
+                self.conn.commit()
+        return found
+
+    def store(self, items: dict):
+        """Store key -> vector pairs, evicting the least recently used entries above max_entries."""
+        now = time.time()
+        with self.lock:
+            for key, vector in items.items():
+                self.remember(key, vector)
+            # Eviction below must see the recent uses.
+            self.write_touches()
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                ((key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()),
+            )
+            self.entries += self.conn.total_changes - before
+            overflow = self.entries - self.max_entries
+            if overflow > 0:
+                self.conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                )
+                self.entries = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self.conn.commit()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed a list of texts, encoding only the ones missing from the cache."""
+        keys = [self.cache_key(text) for text in texts]
+        cached = self.lookup(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+
+        self.count(len(texts) - len(missing), len(missing))
+        if missing:
+            vectors = self.embedding.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.store(computed)
+            cached.update(computed)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed a query; repeated query strings are served from the cache."""
+        key = self.cache_key(text)
+        cached = self.lookup([key])
+        if key in cached:
+            self.count(hits=1)
+            return cached[key]
+        self.count(misses=1)
+        vector = self.embedding.embed_query(text)
+        self.store({key: vector})
+        return vector
+
+    def count(self, hits: int = 0, misses: int = 0):
+        if hits:
+            self.metrics.inc("rag_embedding_cache_hits_total", value=hits)
+        if misses:
+            self.metrics.inc("rag_embedding_cache_misses_total", value=misses)
+
+    def close(self):
+        """Write the deferred last_used updates."""
+        with self.lock:
+            self.write_touches()
+            self.conn.commit()
+
+    def stats(self) -> dict:
+        return {
+            "hits": int(self.metrics.get("rag_embedding_cache_hits_total")),
+            "misses": int(self.metrics.get("rag_embedding_cache_misses_total")),
+            "entries": self.entries,
+        }
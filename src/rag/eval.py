@@ -1,5 +1,15 @@
-from retrivial import Retrivial
-from langchain_ollama import OllamaLLM  # or use your preferred import if needed
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from rag.retrivial import Retrivial
+from rag.resources import SharedResources
+from config import EVAL_CACHE_PATH, OLLAMA_MODEL, CONTEXT_TOKEN_BUDGET, RETRIEVAL_MAX_DISTANCE
 
 EVAL_PROMPT = """
 Expected Response: {expected_response}
@@ -8,83 +18,223 @@ Actual Response: {actual_response}
 (Answer with 'true' or 'false') Does the actual response match the expected response?
 """
 
-def query_and_validate(question: str, expected_response: str) -> bool:
+# Used when no cases file is given.
+DEFAULT_CASES = [
+    {
+        "name": "Monopoly Rules",
+        "question": "How much total money does a player start with in Monopoly? (Answer with the number only)",
+        "expected_response": "$1500",
+    },
+    {
+        "name": "Ticket to Ride Rules",
+        "question": "How many points does the longest continuous train get in Ticket to Ride? (Answer with the number only)",
+        "expected_response": "10 points",
+    },
+    {
+        "name":"Land in tax",
+        "question": "what should i do if i land in income tax",
+        "expected_response": "You may estimate your tax at $900 and pay the Bank, or you may pay 10% \\of your total worth to the Bank"
+    }
+]
+
+_resources = None
+
+def get_resources() -> SharedResources:
+    """Build the shared clients once and reuse them for every test case."""
+    global _resources
+    if _resources is None:
+        _resources = SharedResources()
+    return _resources
+
+def load_cases(path: str = None) -> list[dict]:
     """
-    Executes the query using Retrivial, evaluates the answer with the OllamaLLM model,
-    and returns True if the evaluation returns 'true', False if 'false'.
+    Load test cases from a JSONL or CSV file with the fields name (optional), question, expected_response
+    and expected_sources (chunk ids, "source:page" or source names; a list in JSONL, ";"-separated in CSV).
+    Returns: list of case dicts, DEFAULT_CASES when no path is given.
     """
-    # Generate the actual response using your retrieval agent
-    agent = Retrivial(question)
-    response_text,_,_ = agent.run()
-
-    # Prepare the evaluation prompt
-    prompt = EVAL_PROMPT.format(
-        expected_response=expected_response,
-        actual_response=response_text
-    )
-    
-    # Instantiate the OllamaLLM client with the correct base URL and settings
-    model = OllamaLLM(
-        base_url="http://ollama:11434/",  # Ensure trailing slash if required
-        model="llama3.2:1b",
-        temperature=0.1,
-    )
-    
-    # Get the evaluation result from the model
-    evaluation_results_str = model.invoke(prompt)
-    evaluation_results_str_cleaned = evaluation_results_str.strip().lower()
+    if path is None:
+        rows = DEFAULT_CASES
+    elif path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
 
-    print("\n=== Evaluation Prompt ===")
-    print(prompt)
-    print("=== Evaluation Result ===")
-    print(evaluation_results_str_cleaned)
+    cases = []
+    for i, row in enumerate(rows):
+        expected_sources = row.get("expected_sources") or []
+        if isinstance(expected_sources, str):
+            expected_sources = [source.strip() for source in expected_sources.split(";") if source.strip()]
+        cases.append({
+            "name": row.get("name") or f"case-{i + 1}",
+            "question": row["question"],
+            "expected_response": row.get("expected_response") or "",
+            "expected_sources": expected_sources,
+        })
+    return cases
 
-    # Determine if the response is correct or not based on the evaluation result
+def cache_key(*parts) -> str:
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+class EvalCache:
+    """
+    Disk cache of generated answers and judge verdicts, so a rerun only calls the LLM for
+    the cases (or the retrieval/prompt settings) that changed.
+    """
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, created REAL)")
+        self.conn.commit()
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)", (key, value, time.time()))
+            self.conn.commit()
+
+def parse_verdict(evaluation_results_str: str) -> bool:
+    """Read the judge's answer. Raises ValueError when it is neither 'true' nor 'false'."""
+    evaluation_results_str_cleaned = evaluation_results_str.strip().lower()
     if "true" in evaluation_results_str_cleaned:
-        print("\033[92m" + "Result: CORRECT" + "\033[0m")
         return True
     elif "false" in evaluation_results_str_cleaned:
-        print("\033[91m" + "Result: INCORRECT" + "\033[0m")
         return False
-    else:
-        raise ValueError(
-            f"Invalid evaluation result. Cannot determine if 'true' or 'false': {evaluation_results_str_cleaned}"
+    raise ValueError(
+        f"Invalid evaluation result. Cannot determine if 'true' or 'false': {evaluation_results_str_cleaned}"
+    )
+
+class Evaluator:
+    """
+    Runs the test cases concurrently (at most `concurrency` LLM calls at a time) with the shared clients.
+    Answers are cached per question and retrieval/prompt settings, and verdicts per expected/actual answer pair.
+    """
+    def __init__(self, resources, cache: EvalCache = None, concurrency: int = 4):
+        self.resources = resources
+        self.cache = cache
+        # Answers are generated through the LLM gateway, which would time out the calls queued beyond its limit.
+        if concurrency > resources.gateway.max_in_flight:
+            print(f"Concurrency lowered from {concurrency} to LLM_MAX_IN_FLIGHT ({resources.gateway.max_in_flight})")
+            concurrency = resources.gateway.max_in_flight
+        self.semaphore = asyncio.Semaphore(concurrency)
+        probe = Retrivial("", resources)
+        # Anything that changes the generated answer. The content hash of every ingested file changes
+        # when a document is added, edited or removed, even if the number of chunks stays the same.
+        self.fingerprint = cache_key(
+            OLLAMA_MODEL, probe.PROMPT_TEMPLATE, probe.k, CONTEXT_TOKEN_BUDGET, RETRIEVAL_MAX_DISTANCE,
+            json.dumps(sorted(resources.chunk_index.file_hashes().items())), resources.collection.count(),
         )
 
-def run_tests():
-    # List your test cases in a structured way
-    test_cases = [
-        {
-            "name": "Monopoly Rules",
-            "question": "How much total money does a player start with in Monopoly? (Answer with the number only)",
-            "expected_response": "$1500",
-        },
-        {
-            "name": "Ticket to Ride Rules",
-            "question": "How many points does the longest continuous train get in Ticket to Ride? (Answer with the number only)",
-            "expected_response": "10 points",
-        },
-        {
-            "name":"Land in tax",
-            "question": "what should i do if i land in income tax",
-            "expected_response": "You may estimate your tax at $900 and pay the Bank, or you may pay 10% \of your total worth to the Bank"
-        }
-    ]
-
-    correct_count = 0
-    total_tests = len(test_cases)
-
-    # Run each test case and track successes
-    for test in test_cases:
-        print(f"\n--- Running Test: {test['name']} ---")
+    def cached(self, key: str):
+        return self.cache.get(key) if self.cache is not None else None
+
+    def store(self, key: str, value: str):
+        if self.cache is not None:
+            self.cache.set(key, value)
+
+    async def answer(self, question: str):
+        """Returns: (response_text, served from the cache)"""
+        key = cache_key("answer", self.fingerprint, question)
+        response_text = self.cached(key)
+        if response_text is not None:
+            return response_text, True
+        async with self.semaphore:
+            response_text,_,_ = await Retrivial(question, self.resources).arun()
+        self.store(key, response_text)
+        return response_text, False
+
+    async def judge(self, expected_response: str, response_text: str):
+        """Returns: (verdict, served from the cache)"""
+        key = cache_key("verdict", OLLAMA_MODEL, EVAL_PROMPT, expected_response, response_text)
+        verdict = self.cached(key)
+        if verdict is not None:
+            return verdict == "true", True
+        prompt = EVAL_PROMPT.format(expected_response=expected_response, actual_response=response_text)
+        async with self.semaphore:
+            verdict = parse_verdict(await self.resources.llm.ainvoke(prompt))
+        self.store(key, "true" if verdict else "false")
+        return verdict, False
+
+    async def run_case(self, case: dict) -> dict:
+        result = {"name": case["name"], "passed": False, "cached": False, "error": None}
         try:
-            result = query_and_validate(test["question"], test["expected_response"])
-            if result:
-                correct_count += 1
+            response_text, cached_answer = await self.answer(case["question"])
+            result["passed"], cached_verdict = await self.judge(case["expected_response"], response_text)
+            result["cached"] = cached_answer and cached_verdict
         except Exception as e:
-            print("\033[91m" + f"Test {test['name']} failed with exception: {e}" + "\033[0m")
-    
-    # Calculate and print the accuracy
-    accuracy = (correct_count / total_tests) * 100 if total_tests > 0 else 0
-    print("\n=== Test Summary ===")
-    print(f"Passed {correct_count} out of {total_tests} tests. Accuracy: {accuracy:.2f}%")
+            result["error"] = str(e)
+        if result["error"]:
+            print("\033[91m" + f"Test {case['name']} failed with exception: {result['error']}" + "\033[0m")
+        elif result["passed"]:
+            print("\033[92m" + f"{case['name']}: CORRECT" + "\033[0m")
+        else:
+            print("\033[91m" + f"{case['name']}: INCORRECT" + "\033[0m")
+        return result
+
+    async def run(self, cases: list[dict]) -> dict:
+        results = await asyncio.gather(*(self.run_case(case) for case in cases))
+        correct_count = sum(result["passed"] for result in results)
+        total_tests = len(results)
+        # Calculate and print the accuracy
+        accuracy = (correct_count / total_tests) * 100 if total_tests > 0 else 0
+        print("\n=== Test Summary ===")
+        print(f"Passed {correct_count} out of {total_tests} tests. Accuracy: {accuracy:.2f}%")
+        print(f"{sum(result['cached'] for result in results)} cases were served from the cache.")
+        return {"accuracy": accuracy, "results": results}
+
+def matches(chunk_id: str, expected: str) -> bool:
+    """An expected source matches a chunk id ("source:page:hash") exactly, by "source:page" or by source."""
+    return chunk_id == expected or chunk_id.startswith(expected + ":")
+
+def evaluate_retrieval(resources, cases: list[dict], k: int = 5, batch_size: int = 64) -> dict:
+    """
+    Retrieval-only evaluation, without any LLM call: recall@k and MRR of the similarity search
+    against the expected sources of each case.
+    """
+    cases = [case for case in cases if case["expected_sources"]]
+    results = []
+    for start in range(0, len(cases), batch_size):
+        batch = cases[start:start + batch_size]
+        embeddings = resources.embedding.embed_documents([case["question"] for case in batch])
+        for case, docs in zip(batch, resources.search_by_vectors(embeddings, k=k)):
+            ids = [doc.metadata.get("id", "") for doc, _ in docs]
+            found = [expected for expected in case["expected_sources"] if any(matches(chunk_id, expected) for chunk_id in ids)]
+            rank = next((i + 1 for i, chunk_id in enumerate(ids) if any(matches(chunk_id, e) for e in case["expected_sources"])), None)
+            results.append({
+                "name": case["name"],
+                "recall": len(found) / len(case["expected_sources"]),
+                "reciprocal_rank": 1 / rank if rank else 0.0,
+            })
+            print(f"{case['name']}: recall@{k}={results[-1]['recall']:.2f} rank={rank}")
+
+    recall = sum(result["recall"] for result in results) / len(results) if results else 0.0
+    mrr = sum(result["reciprocal_rank"] for result in results) / len(results) if results else 0.0
+    print("\n=== Retrieval Summary ===")
+    print(f"{len(results)} cases with expected sources. recall@{k}: {recall:.4f}  MRR: {mrr:.4f}")
+    return {f"recall@{k}": recall, "mrr": mrr, "results": results}
+
+def run_tests(cases: list[dict] = None, concurrency: int = 4, use_cache: bool = True) -> dict:
+    cases = load_cases() if cases is None else cases
+    evaluator = Evaluator(get_resources(), EvalCache(EVAL_CACHE_PATH) if use_cache else None, concurrency)
+    return asyncio.run(evaluator.run(cases))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the RAG pipeline against a set of test cases.")
+    parser.add_argument("--cases", help="JSONL or CSV file of test cases (the built-in cases when omitted)")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum number of LLM calls in flight")
+    parser.add_argument("--retrieval-only", action="store_true", help="only compute recall@k and MRR, without the LLM")
+    parser.add_argument("-k", type=int, default=5, help="number of chunks retrieved in retrieval-only mode")
+    parser.add_argument("--no-cache", action="store_true", help="neither read nor write the cache of answers and verdicts")
+    args = parser.parse_args()
+
+    cases = load_cases(args.cases)
+    if args.retrieval_only:
+        evaluate_retrieval(get_resources(), cases, k=args.k)
+    else:
+        run_tests(cases, concurrency=args.concurrency, use_cache=not args.no_cache)
@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILLER_WORDS = "the player moves the token around the board and collects money when passing start".split()
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Implements the subset of the Ollama HTTP API used by OllamaLLM: /api/generate (streamed NDJSON) and /api/tags."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, payload: dict):
+        line = (json.dumps(payload) + "\n").encode()
+        self.wfile.write(f"{len(line):X}\r\n".encode() + line + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/api/tags":
+            self.send_json({"models": [{"name": self.server.model, "model": self.server.model}]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.rstrip("/") == "/api/show":
+            self.send_json({"modelfile": "", "parameters": "", "template": "", "details": {}})
+            return
+        if self.path.rstrip("/") != "/api/generate":
+            self.send_error(404)
+            return
+
+        server = self.server
+        started = time.perf_counter()
+        prompt_tokens = len(request.get("prompt", "").split())
+        tokens = [FILLER_WORDS[i % len(FILLER_WORDS)] + " " for i in range(server.response_tokens)]
+        time.sleep(server.first_token_latency)
+
+        base = {"model": request.get("model", server.model)}
+        if not request.get("stream", True):
+            time.sleep(len(tokens) / server.tokens_per_second)
+            self.send_json({
+                **base,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "response": "".join(tokens),
+                "done": True,
+                "done_reason": "stop",
+                "prompt_eval_count": prompt_tokens,
+                "eval_count": len(tokens),
+                "total_duration": int((time.perf_counter() - started) * 1e9),
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in tokens:
+            time.sleep(1 / server.tokens_per_second)
+            self.send_chunk({**base, "created_at": datetime.now(timezone.utc).isoformat(), "response": token, "done": False})
+        self.send_chunk({
+            **base,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "response": "",
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": len(tokens),
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+        })
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    """
+    Local stand-in for Ollama used by the benchmark suite. Every generation waits first_token_latency seconds,
+    then streams response_tokens tokens at tokens_per_second, and reports prompt_eval_count/eval_count like Ollama.
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, model: str = "llama3.2:1b",
+                 tokens_per_second: float = 50.0, first_token_latency: float = 0.2, response_tokens: int = 64):
+        super().__init__((host, port), FakeOllamaHandler)
+        self.model = model
+        self.tokens_per_second = tokens_per_second
+        self.first_token_latency = first_token_latency
+        self.response_tokens = response_tokens
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="fake-ollama", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    server = FakeOllamaServer(port=11434)
+    print(f"Fake Ollama listening on {server.url}")
+    server.serve_forever()
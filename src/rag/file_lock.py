@@ -0,0 +1,39 @@
+import fcntl
+import os
+
+
+class FileLockHeld(RuntimeError):
+    """Raised when another process holds a conflicting lock on the file."""
+
+
+class FileLock:
+    """
+    Advisory lock (flock) on a file, used by the processes that share local state in DATA_DIR (API workers,
+    command line tools) so that they cannot step on each other. The lock is released by release() or when
+    the process exits.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def acquire(self, shared: bool = False):
+        """
+        Take the lock without waiting: shared locks can be held by several processes, an exclusive one by one.
+        Raises FileLockHeld when another process holds a conflicting lock.
+        Returns: self
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        file = open(self.path, "a")
+        try:
+            fcntl.flock(file, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            raise FileLockHeld(f"'{self.path}' is locked by another process.")
+        self.file = file
+        return self
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
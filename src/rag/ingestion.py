@@ -1,52 +1,118 @@
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.document_loaders import UnstructuredMarkdownLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-import chromadb
-from langchain.schema.document import Document
-import os
-import tempfile
-from chromadb.config import Settings
-from langchain_community.embeddings.sentence_transformer import (
-    SentenceTransformerEmbeddings,
-)
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+from rag.markdown_parsing import iter_markdown_sections
+from rag.uploads import hash_file
+from config import INGEST_BATCH_SIZE
+import hashlib
+import logging
+import time
+
+if TYPE_CHECKING:
+    from langchain.schema.document import Document
+
+logger = logging.getLogger(__name__)
+
 class DocumentIngestor:
 
     """
     Class to handle the document ingestion process. It loads, splits, clear, and embeds documents into the vector store
     """
-    def __init__(self):
+    def __init__(self, resources):
         # self.embedding = OllamaEmbeddings(model = "llama3.2:1b")
         # self.embedding = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
         # self.embedding = OllamaEmbeddings(model = "nomic-embed-text")
         
-        self.embedding = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
-        # self.vs = Chroma(persist_directory= PERSIST_DIRECTORY,embedding_function = self.embedding)
-
-        client = chromadb.HttpClient(host="chroma", port=8000, settings=Settings(allow_reset=True))
-
-        self.vs = Chroma(client=client, collection_name="my_collection", embedding_function = self.embedding )
-        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size = 800, chunk_overlap = 80, length_function = len,is_separator_regex=False )
+        # The embedding model and the Chroma client are shared process-wide (see rag.resources).
+        self.embedding = resources.embedding
+        self.vs = resources.vs
+        self.collection = resources.collection
+        self.chunk_index = resources.chunk_index
+        self.local_index = resources.local_index
+        self.metrics = resources.metrics
+        self.batch_size = INGEST_BATCH_SIZE
+        # Process-pool backed PDF loader, None when parallel parsing is disabled.
+        self.pdf_loader = resources.pdf_loader
+        # Seconds spent per ingestion stage (load, split, embed, upsert) by the last run.
+        self.timings = {}
+        self.chunk_size = 800
+        # LangChain is imported here rather than with the module, so that importing the app stays cheap.
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size = self.chunk_size, chunk_overlap = 80, length_function = len,is_separator_regex=False )
+        # Fallback for Markdown sections longer than a chunk; reports where each piece starts in its section.
+        self.section_splitter = RecursiveCharacterTextSplitter(chunk_size = self.chunk_size, chunk_overlap = 80, length_function = len,is_separator_regex=False, add_start_index=True)
         
-    def load_documents(self, doc_path: str, doc_type: str):
+    def lazy_load_documents(self, doc_path: str, doc_type: str):
         """
-        Load documents from the specified DOCUMENT_PATH based on the document type.
+        Lazily load a document page by page, so that the whole document never has to be held in memory.
 
         Args:
+            doc_path (str): Path to the document.
             doc_type (str): The type of document to load. Supported values are "pdf" and "md".
 
-        Returns:
-            A document loaded from the directory.
+        Yields: Document, one per page (one per section for Markdown).
         """
-        
         if doc_type == "md":
-            loader = UnstructuredMarkdownLoader(doc_path)
-            document = loader.load()
+            pages = self.load_markdown(doc_path)
+        elif self.pdf_loader is not None:
+            from langchain.schema.document import Document
+            pages = (
+                Document(page_content=text, metadata={"source": doc_path, "page": page})
+                for page, text in self.pdf_loader.lazy_load(doc_path)
+            )
         else:
-            loader = PyPDFLoader(file_path=doc_path)
-            document = loader.load()
-            
-        return document
+            from langchain_community.document_loaders import PyPDFLoader
+            pages = iter(PyPDFLoader(file_path=doc_path).lazy_load())
+        while True:
+            started = time.perf_counter()
+            try:
+                page = next(pages)
+            except StopIteration:
+                return
+            finally:
+                self.add_timing("load", started)
+            yield page
+
+    def load_markdown(self, doc_path: str):
+        """
+        Load a Markdown file section by section (see rag.markdown_parsing), in one streaming pass.
+        Yields: Document per section, with its heading path ("Title > Subtitle") as section metadata
+        and its character offsets in the file as start_index and end_index.
+        """
+        from langchain.schema.document import Document
+        for section in iter_markdown_sections(doc_path):
+            text = section.text.strip()
+            start = section.start + len(section.text) - len(section.text.lstrip())
+            yield Document(
+                page_content=text,
+                metadata={"source": doc_path, "section": " > ".join(section.path), "start_index": start, "end_index": start + len(text)},
+            )
+
+    def iter_chunks(self, pages, source: str):
+        """
+        Split pages into chunks as they are loaded.
+        Args:
+            pages: iterable of Document pages.
+            source (str): The original filename, stored as the source of every chunk.
+        Yields: Document chunks with their id metadata.
+        """
+        for page in pages:
+            started = time.perf_counter()
+            page.metadata["source"] = source
+            chunks = self.calculate_chunk_ids(self.split_section(page) if "section" in page.metadata else self.split_documents([page]))
+            self.add_timing("split", started)
+            yield from chunks
+
+    def iter_batches(self, chunks):
+        """Group a chunk iterator into lists of at most batch_size chunks."""
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
     def split_documents(self,documents : list[Document]):
         """Split the documents into chunks
@@ -56,66 +122,155 @@ class DocumentIngestor:
         """
         return self.text_splitter.split_documents(documents)
     
-    def embed_to_vs(self,chunks : list[Document]):
-        """
-        Function to embed the new chunks to the vector store. The chunks that added to vector store ensured new.
-        """
-        chunks_with_ids = self.calculate_chunk_ids(chunks)
-        existing_items = self.vs.get(include = [])
-        existing_ids = set(existing_items['ids'])
-        print(f"Number of existing documents in DB : {len(existing_ids)}")
-        new_chunks = []
-        for chunk in chunks_with_ids:
-            if chunk.metadata['id'] not in existing_ids:
-                new_chunks.append(chunk)
-        if len(new_chunks) == 0:
-            print("No new documents to add")
-        else:
-            new_chunk_ids = [chunk.metadata['id'] for chunk in new_chunks]
-            self.vs.add_documents(new_chunks, ids = new_chunk_ids)
-            # self.vs.persist()
-            print(f"Added {len(new_chunks)} new documents to DB")
+    def split_section(self, section : Document):
+        """
+        Split a Markdown section on its own, so that no chunk spans two sections. A section that fits in a chunk
+        is kept whole; a longer one falls back to the size-based splitter, with the offsets of the pieces
+        shifted from the section to the file.
+        Returns: Chunks of the section.
+        """
+        if len(section.page_content) <= self.chunk_size:
+            return [section]
+        section_start = section.metadata["start_index"]
+        chunks = self.section_splitter.split_documents([section])
+        for chunk in chunks:
+            chunk.metadata["start_index"] += section_start
+            chunk.metadata["end_index"] = chunk.metadata["start_index"] + len(chunk.page_content)
+        return chunks
 
-    def calculate_chunk_ids(self, chunks : list[Document]):
-        """Calculate and add id metadata to each chunk based on the source and page number."""
-        last_page_id = None
-        current_chunk_index = 0
+    def select_new_chunks(self, chunks : list[Document], seen_ids : set):
+        """
+        Drop the chunks that are already stored or were already seen in this ingestion.
+        Only the ids of the candidate chunks are looked up in the local chunk index, so the cost does not grow
+        with the size of the collection.
+        Args:
+            chunks (list[Document]): Chunks with id metadata.
+            seen_ids (set): Ids already handled in this ingestion; updated in place.
+        Returns: (new chunks, number of skipped chunks)
+        """
+        # Identical chunks of the same page share an id; keep the first one.
+        unique_chunks = {}
+        for chunk in chunks:
+            if chunk.metadata['id'] not in seen_ids:
+                unique_chunks.setdefault(chunk.metadata['id'], chunk)
+        seen_ids.update(unique_chunks)
+        existing_ids = self.chunk_index.existing(list(unique_chunks))
+        new_chunks = [chunk for chunk_id, chunk in unique_chunks.items() if chunk_id not in existing_ids]
+        return new_chunks, len(chunks) - len(new_chunks)
+
+    def upsert_batch(self, chunks : list[Document], embeddings : list[list[float]]):
+        """Write a batch of chunks with precomputed embeddings to the vector store and the chunk index."""
+        if not chunks:
+            return
+        started = time.perf_counter()
+        ids = [chunk.metadata['id'] for chunk in chunks]
+        documents = [chunk.page_content for chunk in chunks]
+        # Chroma only accepts scalar metadata values.
+        metadatas = [{key: value for key, value in chunk.metadata.items() if value is not None} for chunk in chunks]
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+        self.chunk_index.add(ids, [chunk.metadata['source'] for chunk in chunks])
+        if self.local_index is not None:
+            self.local_index.add(ids, embeddings, documents, metadatas)
+        self.add_timing("upsert", started)
+
+    def embed_chunks(self, chunks : list[Document]):
+        """Embed the text of a batch of chunks."""
+        if not chunks:
+            return []
+        started = time.perf_counter()
+        embeddings = self.embedding.embed_documents([chunk.page_content for chunk in chunks])
+        self.add_timing("embed", started)
+        return embeddings
+
+    def add_timing(self, stage: str, started: float):
+        elapsed = time.perf_counter() - started
+        self.timings[stage] = self.timings.get(stage, 0.0) + elapsed
+        self.metrics.observe("rag_stage_duration_seconds", {"pipeline": "ingest", "stage": stage}, elapsed)
+
+    def remove_stale_chunks(self, source: str, current_ids):
+        """
+        Delete the chunks of a source that are not part of its latest upload, e.g. after a file was edited
+        and re-uploaded under the same name.
+        Returns: int, the number of deleted chunks.
+        """
+        stale_ids = list(self.chunk_index.ids_for_source(source) - set(current_ids))
+        if stale_ids:
+            self.vs.delete(stale_ids)
+            self.chunk_index.remove(stale_ids)
+            if self.local_index is not None:
+                self.local_index.remove(stale_ids)
+            logger.info(f"Deleted {len(stale_ids)} stale chunks of '{source}'")
+        return len(stale_ids)
 
+    def calculate_chunk_ids(self, chunks : list[Document]):
+        """
+        Calculate and add id metadata to each chunk based on the source, page number and a hash of its content.
+        An edited file uploaded under the same name therefore gets new ids for the chunks whose text changed.
+        """
         for chunk in chunks:
             source = chunk.metadata.get("source")
             page = chunk.metadata.get("page")
-            current_page_id = f"{source}:{page}"
-
-            # If the page ID is the same as the last one, increment the index.
-            if current_page_id == last_page_id:
-                current_chunk_index += 1
-            else:
-                current_chunk_index = 0
-
-            # Calculate the chunk ID.
-            chunk_id = f"{current_page_id}:{current_chunk_index}"
-            last_page_id = current_page_id
+            content_hash = hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()[:16]
 
             # Add it to the page meta-data.
-            chunk.metadata["id"] = chunk_id
+            chunk.metadata["id"] = f"{source}:{page}:{content_hash}"
 
         return chunks
-    def run_from_api(self, file_content: bytes, filename: str, extension: str):
-    # Create a temporary directory
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_file_path = os.path.join(temp_dir, filename)
-            with open(temp_file_path, "wb") as temp_file:
-                temp_file.write(file_content)
-            
-            # Process the file.
-            documents = self.load_documents(temp_file_path, extension)
-            # Normalize the source in each document to the original filename
-            for doc in documents:
-                doc.metadata["source"] = filename
-            chunks = self.split_documents(documents)
-            self.embed_to_vs(chunks)
+    def run_from_path(self, file_path: str, filename: str, extension: str, progress=None, content_hash: str = None):
+        """
+        Ingest a file as a streaming pipeline: pages are loaded lazily, split, embedded in batches of batch_size
+        chunks and upserted to Chroma batch by batch, so peak memory is bounded by the batch size and not by
+        the document size. The upsert of a batch runs in the background while the next batch is embedded.
+
+        Args:
+            file_path (str): Path of the file to ingest.
+            filename (str): The original filename, stored as the source of every chunk.
+            extension (str): "pdf" or "md".
+            progress: Optional callable, called with the stats dict after every stored batch.
+            content_hash (str): SHA-256 of the file when the caller already computed it.
+
+        Returns: dict with the number of chunks in the file, how many were added, skipped and removed as stale,
+        whether the file was skipped as unchanged, and the seconds spent per stage.
+        """
+        self.timings = {}
+        stats = {"batches": 0, "chunks": 0, "added": 0, "skipped": 0, "removed": 0, "unchanged": False, "timings": self.timings}
+        content_hash = content_hash or hash_file(file_path)
+        if self.chunk_index.file_hash(filename) == content_hash:
+            # Same bytes as the last ingested version of this source: nothing to parse or embed.
+            logger.info(f"'{filename}' is unchanged since its last ingestion, skipping it")
+            stats["unchanged"] = True
+            self.report_progress(stats, progress)
+            return stats
+        seen_ids = set()
+        pages = self.lazy_load_documents(file_path, extension)
+        with ThreadPoolExecutor(max_workers=1) as upserter:
+            pending = None
+            for batch in self.iter_batches(self.iter_chunks(pages, filename)):
+                new_chunks, skipped = self.select_new_chunks(batch, seen_ids)
+                embeddings = self.embed_chunks(new_chunks)
+
+                # Wait for the previous upsert before queueing this one, so at most two batches are in memory.
+                if pending is not None:
+                    pending.result()
+                    self.report_progress(stats, progress)
+                pending = upserter.submit(self.upsert_batch, new_chunks, embeddings)
+                stats["batches"] += 1
+                stats["chunks"] += len(batch)
+                stats["added"] += len(new_chunks)
+                stats["skipped"] += skipped
+            if pending is not None:
+                pending.result()
+
+        stats["removed"] = self.remove_stale_chunks(filename, seen_ids)
+        self.chunk_index.set_file_hash(filename, content_hash)
+        self.report_progress(stats, progress)
+        logger.info(f"Added {stats['added']} new documents to DB, skipped {stats['skipped']} existing ones")
+        return stats
+
+    def report_progress(self, stats: dict, progress=None):
+        if progress is not None:
+            progress({**stats, "timings": dict(stats["timings"])})
 
-            
     def clear_database(self) -> int:
         """
         Clears all vectors/documents from the vector store.
@@ -131,6 +286,9 @@ class DocumentIngestor:
             data = self.vs.get(include=[])
             ids = data.get("ids", [])
             print("before clear:", len(ids))
+            self.chunk_index.clear()
+            if self.local_index is not None:
+                self.local_index.clear()
             if ids:
                 self.vs.delete(ids)
                 num_deleted = len(ids)
@@ -153,7 +311,8 @@ class DocumentIngestor:
         print(len(self.vs.get()['documents']))
 
 if __name__ == "__main__":
-    di = DocumentIngestor()
+    from rag.resources import SharedResources
+    di = DocumentIngestor(SharedResources())
     di.check()
     # try:
         # num_deleted = di.clear_database()
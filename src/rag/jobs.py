@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from rag.ingestion import DocumentIngestor
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when the ingestion queue already holds the maximum number of pending jobs."""
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class IngestJobQueue:
+    """
+    Background ingestion queue. Uploaded files are spooled to disk and a job is recorded in a local SQLite
+    table, then a bounded thread pool runs DocumentIngestor on them. Job state, chunk counts and per-stage
+    timings are kept in the table, so pending jobs survive a restart and are picked up again by resume().
+    """
+    def __init__(self, resources, path: str, workers: int = 2, max_pending: int = 100, on_complete=None):
+        self.resources = resources
+        self.max_pending = max_pending
+        self.on_complete = on_complete
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, filename TEXT, extension TEXT, file_path TEXT, state TEXT, owner_pid INTEGER, "
+            "stats TEXT, error TEXT, created REAL, updated REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        self.conn.commit()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+
+    def execute(self, query: str, params=()):
+        with self.lock:
+            cursor = self.conn.execute(query, params)
+            self.conn.commit()
+            return cursor
+
+    def submit(self, file_path: str, filename: str, extension: str) -> str:
+        """
+        Queue the ingestion of a spooled file.
+        Returns: str, the job id.
+        Raises: QueueFull when max_pending jobs are already waiting.
+        """
+        pending = self.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+        if pending >= self.max_pending:
+            raise QueueFull(f"{pending} ingestion jobs are already pending")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self.execute(
+            "INSERT INTO jobs (id, filename, extension, file_path, state, stats, created, updated) "
+            "VALUES (?, ?, ?, ?, 'queued', '{}', ?, ?)",
+            (job_id, filename, extension, file_path, now, now),
+        )
+        self.executor.submit(self.run_job, job_id)
+        return job_id
+
+    def get(self, job_id: str):
+        """Return the state of a job as a dict, or None for an unknown job id."""
+        row = self.execute(
+            "SELECT id, filename, state, stats, error, created, updated FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job_id, filename, state, stats, error, created, updated = row
+        return {
+            "job_id": job_id,
+            "filename": filename,
+            "state": state,
+            "stats": json.loads(stats),
+            "error": error,
+            "created": created,
+            "updated": updated,
+        }
+
+    def update_stats(self, job_id: str, stats: dict):
+        self.execute("UPDATE jobs SET stats = ?, updated = ? WHERE id = ?", (json.dumps(stats), time.time(), job_id))
+
+    def run_job(self, job_id: str):
+        """Claim a queued job and ingest its file. Runs in the worker pool."""
+        claimed = self.execute(
+            "UPDATE jobs SET state = 'running', owner_pid = ?, updated = ? WHERE id = ? AND state = 'queued'",
+            (os.getpid(), time.time(), job_id),
+        ).rowcount
+        if not claimed:
+            return
+        file_path, filename, extension = self.execute(
+            "SELECT file_path, filename, extension FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+
+        try:
+            doc_ingestor = DocumentIngestor(self.resources)
+            stats = doc_ingestor.run_from_path(
+                file_path, filename, extension, progress=lambda stats: self.update_stats(job_id, stats)
+            )
+        except Exception as e:
+            logger.exception(f"Ingestion job {job_id} for '{filename}' failed: {e}")
+            self.execute(
+                "UPDATE jobs SET state = 'failed', error = ?, updated = ? WHERE id = ?", (str(e), time.time(), job_id)
+            )
+        else:
+            self.execute(
+                "UPDATE jobs SET state = 'done', stats = ?, updated = ? WHERE id = ?",
+                (json.dumps(stats), time.time(), job_id),
+            )
+            if self.on_complete is not None:
+                self.on_complete(filename, stats)
+        finally:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def resume(self):
+        """
+        Requeue the jobs left behind by a previous run: running jobs whose owner process is gone are reset,
+        then every queued job is handed to the worker pool.
+        """
+        running = self.execute("SELECT id, owner_pid FROM jobs WHERE state = 'running'").fetchall()
+        for job_id, owner_pid in running:
+            if owner_pid is None or owner_pid == os.getpid() or not pid_alive(owner_pid):
+                self.execute("UPDATE jobs SET state = 'queued', updated = ? WHERE id = ?", (time.time(), job_id))
+        queued = self.execute("SELECT id FROM jobs WHERE state = 'queued' ORDER BY created").fetchall()
+        for (job_id,) in queued:
+            self.executor.submit(self.run_job, job_id)
+        if queued:
+            logger.info(f"Resumed {len(queued)} pending ingestion jobs")
+
+    def shutdown(self):
+        """Stop the worker pool. Jobs that have not started stay queued and are resumed on the next start."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
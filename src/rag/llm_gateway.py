@@ -0,0 +1,95 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+
+class GatewayBusy(Exception):
+    """Raised when a generation cannot get an LLM slot: the wait queue is full (429) or the wait timed out (503)."""
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class LLMGateway:
+    """
+    Admission control in front of the shared Ollama client. At most max_in_flight generations run at once;
+    up to max_queue more wait for a slot, each for at most queue_timeout seconds, and anything beyond that
+    is rejected straight away instead of piling up inside Ollama. Queue depth, wait time and rejections are
+    recorded in the metrics registry.
+    """
+    def __init__(self, metrics, max_in_flight: int = 4, max_queue: int = 32, queue_timeout: float = 30.0):
+        self.metrics = metrics
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.waiting = 0
+        self.in_flight = 0
+        # Moving average of how long a slot is held, used for the Retry-After estimate.
+        self.avg_hold = 1.0
+
+    def retry_after(self) -> int:
+        """Seconds until the queue is likely to have drained, as a whole number for the Retry-After header."""
+        return max(1, math.ceil(self.avg_hold * (self.waiting + 1) / self.max_in_flight))
+
+    def reject(self, reason: str, message: str, status_code: int):
+        self.metrics.inc("rag_llm_rejected_total", {"reason": reason})
+        raise GatewayBusy(message, status_code, self.retry_after())
+
+    def check_queue(self):
+        """Raise GatewayBusy (429) when every slot is taken and the wait queue is full, e.g. before a stream starts."""
+        if self.semaphore.locked() and self.waiting >= self.max_queue:
+            self.reject("queue_full", "Too many generations waiting for the LLM.", 429)
+
+    async def acquire(self):
+        """Wait for a generation slot. Raises GatewayBusy when the queue is full or the wait times out."""
+        if not self.semaphore.locked():
+            # A free slot is taken without suspending, so concurrent callers see it as taken.
+            await self.semaphore.acquire()
+            return self.admitted(0.0)
+        self.check_queue()
+
+        self.waiting += 1
+        self.metrics.inc("rag_llm_queue_depth")
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.reject("timeout", "Timed out waiting for the LLM.", 503)
+        finally:
+            self.waiting -= 1
+            self.metrics.inc("rag_llm_queue_depth", value=-1)
+        return self.admitted(time.perf_counter() - started)
+
+    def admitted(self, waited: float) -> float:
+        """Record a granted slot. Returns: the time it was granted, to pass to release()."""
+        self.metrics.observe("rag_llm_queue_wait_seconds", {}, waited)
+        self.in_flight += 1
+        self.metrics.inc("rag_llm_in_flight")
+        return time.perf_counter()
+
+    def release(self, acquired_at: float):
+        self.avg_hold = 0.8 * self.avg_hold + 0.2 * (time.perf_counter() - acquired_at)
+        self.in_flight -= 1
+        self.metrics.inc("rag_llm_in_flight", value=-1)
+        self.semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold a generation slot for the duration of the block."""
+        acquired_at = await self.acquire()
+        try:
+            yield
+        finally:
+            self.release(acquired_at)
+
+    def stats(self) -> dict:
+        """Returns: the limits of this worker's gateway and the in-flight and queued generations of every worker."""
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": int(self.metrics.get("rag_llm_in_flight")),
+            "queue_depth": int(self.metrics.get("rag_llm_queue_depth")),
+            "max_queue": self.max_queue,
+        }
@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import numpy as np
+from rag.file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+
+class LocalVectorIndex:
+    """
+    In-process mirror of the Chroma collection used to answer similarity searches without an HTTP round-trip.
+    The vectors live in a memory-mapped NumPy matrix on disk and the chunk texts and metadata in a SQLite table,
+    so only the matrix pages that are touched are loaded into memory. Chroma remains the source of truth: the
+    mirror is rebuilt from it when their sizes disagree and is kept in sync by DocumentIngestor writes and deletes.
+    Scores are squared L2 distances, the same as Chroma's default "l2" space.
+    The row allocation lives in this process, so the directory is locked: opening it while another process
+    (e.g. the API next to a command line tool) has it open raises FileLockHeld.
+    """
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.file_lock = FileLock(os.path.join(directory, "lock")).acquire()
+        self.vectors_path = os.path.join(directory, "vectors.npy")
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(os.path.join(directory, "rows.sqlite3"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, id TEXT UNIQUE, document TEXT, metadata TEXT)")
+        self.conn.commit()
+        self.load()
+
+    def load(self):
+        """Open the vector matrix and rebuild the in-memory id/row maps from disk."""
+        with self.lock:
+            self.id_to_row = {}
+            self.size = 0
+            self.vectors = None
+            if os.path.exists(self.vectors_path):
+                self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+            if self.vectors is None:
+                # Rows without their vectors are useless; start over and let sync_from_collection refill them.
+                self.conn.execute("DELETE FROM rows")
+                self.conn.commit()
+            for row, chunk_id in self.conn.execute("SELECT row, id FROM rows"):
+                self.id_to_row[chunk_id] = row
+                self.size = max(self.size, row + 1)
+            capacity = 0 if self.vectors is None else self.vectors.shape[0]
+            self.valid = np.zeros(capacity, dtype=bool)
+            self.valid[list(self.id_to_row.values())] = True
+            # Squared norms of the stored vectors, so a search is one matrix-vector product.
+            self.norms = np.zeros(capacity, dtype=np.float32)
+            if self.size:
+                self.norms[:self.size] = np.einsum("ij,ij->i", self.vectors[:self.size], self.vectors[:self.size])
+
+    def count(self) -> int:
+        return len(self.id_to_row)
+
+    def ensure_capacity(self, rows: int, dim: int):
+        """Grow the memory-mapped matrix (doubling its capacity) so that it can hold the given number of rows."""
+        capacity = 0 if self.vectors is None else self.vectors.shape[0]
+        if rows <= capacity:
+            return
+        new_capacity = max(rows, 2 * capacity, 1024)
+        tmp_path = self.vectors_path + ".tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(new_capacity, dim))
+        if capacity:
+            grown[:capacity] = self.vectors[:capacity]
+        grown.flush()
+        del grown
+        self.vectors = None
+        os.replace(tmp_path, self.vectors_path)
+        self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+        self.valid = np.concatenate([self.valid, np.zeros(new_capacity - capacity, dtype=bool)])
+        self.norms = np.concatenate([self.norms, np.zeros(new_capacity - capacity, dtype=np.float32)])
+
+    def add(self, ids: list[str], embeddings, documents: list[str], metadatas: list[dict]):
+        """Insert or overwrite chunks with their embeddings."""
+        if not ids:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self.lock:
+            rows = []
+            for chunk_id in ids:
+                row = self.id_to_row.get(chunk_id)
+                if row is None:
+                    row = self.size
+                    self.size += 1
+                    self.id_to_row[chunk_id] = row
+                rows.append(row)
+            self.ensure_capacity(self.size, embeddings.shape[1])
+            self.vectors[rows] = embeddings
+            self.vectors.flush()
+            self.norms[rows] = np.einsum("ij,ij->i", embeddings, embeddings)
+            self.valid[rows] = True
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO rows (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                zip(rows, ids, documents, (json.dumps(metadata) for metadata in metadatas)),
+            )
+            self.conn.commit()
+
+    def remove(self, ids: list[str]):
+        """Remove chunks from the mirror. Their rows are left unused until the next rebuild."""
+        with self.lock:
+            for chunk_id in ids:
+                row = self.id_to_row.pop(chunk_id, None)
+                if row is not None:
+                    self.valid[row] = False
+            self.conn.executemany("DELETE FROM rows WHERE id = ?", ((chunk_id,) for chunk_id in ids))
+            self.conn.commit()
+
+    def close(self):
+        """Let another process open the directory."""
+        self.file_lock.release()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM rows")
+            self.conn.commit()
+            self.vectors = None
+            if os.path.exists(self.vectors_path):
+                os.remove(self.vectors_path)
+            self.load()
+
+    def where_clause(self, where: dict):
+        """
+        Translate a Chroma metadata filter ({"key": value}, {"key": {"$in": [...]}} and "$and" of those)
+        into an SQL condition on the stored metadata.
+        Returns: (sql, parameters)
+        """
+        if "$and" in where:
+            clauses = [self.where_clause(condition) for condition in where["$and"]]
+            return " AND ".join(f"({sql})" for sql, _ in clauses), [param for _, params in clauses for param in params]
+        (key, condition), = where.items()
+        field = f"json_extract(metadata, '$.{key}')"
+        if isinstance(condition, dict) and "$in" in condition:
+            return f"{field} IN ({','.join('?' * len(condition['$in']))})", list(condition["$in"])
+        if isinstance(condition, dict) and "$eq" in condition:
+            condition = condition["$eq"]
+        return f"{field} = ?", [condition]
+
+    def matching_rows(self, where: dict) -> np.ndarray:
+        """Boolean mask of the rows whose metadata matches a Chroma metadata filter."""
+        sql, params = self.where_clause(where)
+        mask = np.zeros(self.size, dtype=bool)
+        rows = [row for row, in self.conn.execute(f"SELECT row FROM rows WHERE {sql}", params)]
+        mask[rows] = True
+        return mask
+
+    def search(self, embedding, k: int = 5, where: dict = None):
+        """
+        Find the k nearest chunks to a query embedding, among the chunks matching the metadata filter when one is given.
+        Returns: list of (Document, distance) tuples, nearest first, like Chroma's similarity_search_with_score.
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        with self.lock:
+            if not self.id_to_row:
+                return []
+            if where:
+                # Only the rows matching the filter are read from the matrix.
+                candidates = np.flatnonzero(self.valid[:self.size] & self.matching_rows(where))
+                if not len(candidates):
+                    return []
+                distances = self.norms[candidates] - 2 * (self.vectors[candidates] @ query) + query @ query
+            else:
+                candidates = np.arange(self.size)
+                distances = self.norms[:self.size] - 2 * (self.vectors[:self.size] @ query) + query @ query
+                distances[~self.valid[:self.size]] = np.inf
+            k = min(k, len(self.id_to_row), len(candidates))
+            nearest = np.argpartition(distances, k - 1)[:k]
+            nearest = nearest[np.argsort(distances[nearest])]
+            distances = distances[nearest]
+            nearest = candidates[nearest]
+            rows = {
+                row: (chunk_id, document, metadata)
+                for row, chunk_id, document, metadata in self.conn.execute(
+                    f"SELECT row, id, document, metadata FROM rows WHERE row IN ({','.join('?' * len(nearest))})",
+                    [int(row) for row in nearest],
+                )
+            }
+        from langchain.schema.document import Document
+        results = []
+        for row, distance in zip(nearest, distances):
+            chunk_id, document, metadata = rows[int(row)]
+            results.append((Document(page_content=document, metadata=json.loads(metadata)), float(distance)))
+        return results
+
+    def sync_from_collection(self, collection, page_size: int = 1000):
+        """Rebuild the mirror from the Chroma collection when their sizes disagree."""
+        total = collection.count()
+        if total == self.count():
+            return
+        logger.info(f"Rebuilding local vector index from {total} stored chunks")
+        self.clear()
+        for offset in range(0, total, page_size):
+            page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+            self.add(page["ids"], page["embeddings"], page["documents"], [metadata or {} for metadata in page["metadatas"]])
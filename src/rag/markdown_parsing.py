@@ -0,0 +1,113 @@
+import re
+
+ATX_HEADING = re.compile(r"^ {0,3}(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$")
+SETEXT_UNDERLINE = re.compile(r"^ {0,3}(=+|-+)[ \t]*$")
+FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+# Lines that cannot be the title of a setext heading.
+BLOCK_START = re.compile(r"^ {0,3}([-+*]|\d+[.)]|>)([ \t]|$)")
+
+
+class MarkdownSection:
+    """
+    A heading and the text under it, up to the next heading of any level.
+    path holds the titles of the enclosing headings down to this one; start and end are
+    character offsets of the section in the file.
+    """
+    def __init__(self, path: list[str], text: str, start: int):
+        self.path = path
+        self.text = text
+        self.start = start
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.text)
+
+
+def iter_markdown_sections(path: str):
+    """
+    Parse a Markdown file in one streaming pass, line by line, and yield its sections as they end.
+    ATX ("## Title") and setext (underlined) headings open a new section; lines inside fenced code
+    blocks are never taken as headings. The text before the first heading is a section with an empty path.
+    A section that only holds its heading is merged into the next one, so no chunk is a bare title.
+
+    Yields: MarkdownSection in document order.
+    """
+    # Titles of the open headings, indexed by level - 1.
+    titles = [None] * 6
+    section_path, lines, start = [], [], 0
+    # Whether the current section has any text besides its heading.
+    has_body = False
+    offset = 0
+    fence = None
+    # The previous line, held back because a setext underline turns it into a heading.
+    pending = None
+
+    def close_section(heading_start: int):
+        nonlocal lines, start
+        text = "".join(lines)
+        lines = []
+        section_start, start = start, heading_start
+        if text.strip():
+            return MarkdownSection(section_path, text, section_start)
+        return None
+
+    def open_section(level: int, title: str):
+        nonlocal section_path, has_body
+        has_body = False
+        titles[level - 1] = title
+        for deeper in range(level, 6):
+            titles[deeper] = None
+        section_path = [t for t in titles[:level] if t is not None]
+
+    def add_body(line: str):
+        nonlocal has_body
+        lines.append(line)
+        has_body = has_body or bool(line.strip())
+
+    with open(path, encoding="utf-8", errors="replace", newline="") as f:
+        for line in f:
+            line_start, offset = offset, offset + len(line)
+            stripped = line.rstrip("\r\n")
+
+            fence_match = FENCE.match(stripped)
+            if fence is not None:
+                if fence_match and fence_match.group(1)[0] == fence[0] and len(fence_match.group(1)) >= len(fence):
+                    fence = None
+            elif fence_match:
+                fence = fence_match.group(1)
+
+            underline = SETEXT_UNDERLINE.match(stripped) if fence is None else None
+            if pending is not None and underline:
+                # The held-back line is a setext heading: level 1 for "===", 2 for "---".
+                pending_start, pending_line = pending
+                pending = None
+                if has_body:
+                    section = close_section(pending_start)
+                    if section is not None:
+                        yield section
+                open_section(1 if underline.group(1)[0] == "=" else 2, pending_line.strip())
+                lines.extend([pending_line, line])
+                continue
+            if pending is not None:
+                add_body(pending[1])
+                pending = None
+
+            heading = ATX_HEADING.match(stripped) if fence is None and not fence_match else None
+            if heading:
+                if has_body:
+                    section = close_section(line_start)
+                    if section is not None:
+                        yield section
+                open_section(len(heading.group(1)), (heading.group(2) or "").strip())
+                lines.append(line)
+            elif fence is None and not fence_match and stripped.strip() and not underline and not BLOCK_START.match(stripped):
+                # A paragraph line may be the title of a setext heading.
+                pending = (line_start, line)
+            else:
+                add_body(line)
+
+    if pending is not None:
+        add_body(pending[1])
+    section = close_section(offset)
+    if section is not None:
+        yield section
@@ -0,0 +1,305 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds; they span a cached embedding lookup up to a slow CPU generation.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, math.inf)
+
+
+def series_key(name: str, labels: dict = None) -> str:
+    """Build the Prometheus series name, e.g. rag_stage_duration_seconds{pipeline="generate",stage="llm"}."""
+    if not labels:
+        return name
+    rendered = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{rendered}}}"
+
+
+def parse_series_key(key: str):
+    """Inverse of series_key. Returns: (name, labels dict)"""
+    if "{" not in key:
+        return key, {}
+    name, rendered = key[:-1].split("{", 1)
+    labels = {}
+    for pair in rendered.split('",'):
+        label, value = pair.split("=", 1)
+        labels[label] = value.strip('"')
+    return name, labels
+
+
+def format_bucket(bound: float) -> str:
+    return "+Inf" if bound == math.inf else repr(bound)
+
+
+class InMemoryMetricsStore:
+    """Thread-safe map of series key -> value, private to the current process."""
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, key: str, value: float = 1.0):
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + value
+
+    def inc_many(self, items: dict):
+        with self.lock:
+            for key, value in items.items():
+                self.values[key] = self.values.get(key, 0.0) + value
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.values)
+
+    def get(self, key: str) -> float:
+        with self.lock:
+            return self.values.get(key, 0.0)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+class SqliteMetricsStore:
+    """
+    Series key -> value map in a SQLite file shared by every worker process of the API.
+    Increments are single UPSERT statements, so concurrent workers never lose an update,
+    and a snapshot reads the totals of all workers at once.
+    """
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS metrics (key TEXT PRIMARY KEY, value REAL NOT NULL)")
+        self.conn.commit()
+
+    def inc(self, key: str, value: float = 1.0):
+        self.inc_many({key: value})
+
+    def inc_many(self, items: dict):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO metrics (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                items.items(),
+            )
+            self.conn.commit()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.conn.execute("SELECT key, value FROM metrics"))
+
+    def get(self, key: str) -> float:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM metrics WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0.0
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM metrics")
+            self.conn.commit()
+
+
+class BufferedMetricsStore:
+    """
+    Per-process front for a shared store (SqliteMetricsStore). Increments only update in-memory deltas;
+    a background thread merges them into the shared store every flush_interval seconds in one transaction
+    and refreshes a local copy of the shared totals. Reads never touch the shared store either, so the
+    request path does no database I/O; they see the other workers' updates up to flush_interval late.
+    """
+    def __init__(self, shared, flush_interval: float = 1.0):
+        self.shared = shared
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.totals = shared.snapshot()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="metrics-flush", daemon=True)
+        self.thread.start()
+
+    def inc(self, key: str, value: float = 1.0):
+        with self.lock:
+            self.pending[key] = self.pending.get(key, 0.0) + value
+
+    def inc_many(self, items: dict):
+        with self.lock:
+            for key, value in items.items():
+                self.pending[key] = self.pending.get(key, 0.0) + value
+
+    def flush(self):
+        """Merge the pending deltas into the shared store and refresh the local totals."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        try:
+            if pending:
+                self.shared.inc_many(pending)
+            totals = self.shared.snapshot()
+        except Exception:
+            # Keep the deltas for the next attempt (e.g. the database was locked for too long).
+            self.inc_many(pending)
+            raise
+        with self.lock:
+            self.totals = totals
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Could not flush metrics to the shared store: {e}")
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            merged = dict(self.totals)
+            for key, value in self.pending.items():
+                merged[key] = merged.get(key, 0.0) + value
+        return merged
+
+    def get(self, key: str) -> float:
+        with self.lock:
+            return self.totals.get(key, 0.0) + self.pending.get(key, 0.0)
+
+    def clear(self):
+        with self.lock:
+            self.pending.clear()
+            self.totals = {}
+        self.shared.clear()
+
+    def close(self):
+        """Stop the flush thread and write the last deltas."""
+        self.stopped.set()
+        self.thread.join()
+        self.flush()
+
+
+class MetricsRegistry:
+    """
+    Stage- and endpoint-level instrumentation: cumulative latency histograms, in-flight gauges and error counters.
+    Everything is stored as plain series -> value counters, which can be rendered in the Prometheus text format
+    and summarised (count, average, p50/p95/p99 estimated from the buckets) for /stats.
+    """
+    def __init__(self, store=None, buckets=DEFAULT_BUCKETS):
+        self.store = store if store is not None else InMemoryMetricsStore()
+        self.buckets = buckets
+
+    def close(self):
+        """Flush a buffered store before the process exits."""
+        if hasattr(self.store, "close"):
+            self.store.close()
+
+    def inc(self, name: str, labels: dict = None, value: float = 1.0):
+        self.store.inc(series_key(name, labels), value)
+
+    def get(self, name: str, labels: dict = None) -> float:
+        return self.store.get(series_key(name, labels))
+
+    def observe(self, name: str, labels: dict, seconds: float):
+        """Record one latency observation in the histogram `name`."""
+        labels = labels or {}
+        items = {series_key(f"{name}_sum", labels): seconds, series_key(f"{name}_count", labels): 1.0}
+        for bound in self.buckets:
+            if seconds <= bound:
+                items[series_key(f"{name}_bucket", {**labels, "le": format_bucket(bound)})] = 1.0
+        self.store.inc_many(items)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Time a block: its duration goes into the histogram `name`, an in-flight gauge is held while it runs
+        and rag_errors_total is incremented when it raises.
+        """
+        gauge = series_key("rag_in_flight", {"metric": name, **labels})
+        self.store.inc(gauge, 1.0)
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc("rag_errors_total", {"metric": name, **labels})
+            raise
+        finally:
+            self.store.inc(gauge, -1.0)
+            self.observe(name, labels, time.perf_counter() - started)
+
+    def quantile(self, q: float, buckets: list, count: float) -> float:
+        """Estimate a quantile from cumulative (bound, count) buckets by linear interpolation, like histogram_quantile."""
+        rank = q * count
+        previous_bound, previous_count = 0.0, 0.0
+        for bound, cumulative in buckets:
+            if cumulative >= rank:
+                if bound == math.inf:
+                    return previous_bound
+                if cumulative == previous_count:
+                    return bound
+                return previous_bound + (bound - previous_bound) * (rank - previous_count) / (cumulative - previous_count)
+            previous_bound, previous_count = bound, cumulative
+        return previous_bound
+
+    def summary(self) -> dict:
+        """
+        Summarise every histogram series.
+        Returns: dict of series -> {"count", "avg", "p50", "p95", "p99"} with latencies in seconds.
+        """
+        snapshot = self.store.snapshot()
+        histograms = {}
+        for key, value in snapshot.items():
+            name, labels = parse_series_key(key)
+            if not name.endswith("_bucket"):
+                continue
+            le = labels.pop("le")
+            bound = math.inf if le == "+Inf" else float(le)
+            base = series_key(name[:-len("_bucket")], labels)
+            histograms.setdefault(base, []).append((bound, value))
+
+        summary = {}
+        for base, buckets in sorted(histograms.items()):
+            name, labels = parse_series_key(base)
+            count = snapshot.get(series_key(f"{name}_count", labels), 0.0)
+            if not count:
+                continue
+            buckets.sort()
+            total = snapshot.get(series_key(f"{name}_sum", labels), 0.0)
+            summary[base] = {
+                "count": int(count),
+                "avg": round(total / count, 4),
+                "p50": round(self.quantile(0.50, buckets, count), 4),
+                "p95": round(self.quantile(0.95, buckets, count), 4),
+                "p99": round(self.quantile(0.99, buckets, count), 4),
+            }
+        return summary
+
+    def sort_key(self, key: str):
+        """Order series by their labels, and histogram buckets by their numeric bound."""
+        _, labels = parse_series_key(key)
+        le = labels.pop("le", None)
+        bound = 0.0 if le is None else math.inf if le == "+Inf" else float(le)
+        return sorted(labels.items()), bound
+
+    def render_prometheus(self) -> str:
+        """Render every series in the Prometheus text exposition format."""
+        snapshot = self.store.snapshot()
+        by_name = {}
+        for key, value in snapshot.items():
+            name, _ = parse_series_key(key)
+            by_name.setdefault(name, []).append((key, value))
+
+        histogram_names = {name[:-len("_bucket")] for name in by_name if name.endswith("_bucket")}
+        lines = []
+        for name in sorted(by_name):
+            base = next((h for h in histogram_names if name in (f"{h}_bucket", f"{h}_sum", f"{h}_count")), None)
+            if base is not None:
+                if name == f"{base}_bucket":
+                    lines.append(f"# TYPE {base} histogram")
+            elif name.endswith(("in_flight", "queue_depth")):
+                lines.append(f"# TYPE {name} gauge")
+            else:
+                lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(by_name[name], key=lambda item: self.sort_key(item[0])):
+                lines.append(f"{key} {value!r}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,52 @@
+from collections import deque
+from pypdf import PdfReader
+
+
+def count_pages(path: str) -> int:
+    return len(PdfReader(path).pages)
+
+
+def extract_page_range(path: str, start: int, end: int) -> list[str]:
+    """
+    Extract the text of pages [start, end) of a PDF. Runs in a worker process, so it is kept
+    at module level (picklable) and only depends on pypdf.
+    """
+    reader = PdfReader(path)
+    return [reader.pages[page].extract_text() for page in range(start, end)]
+
+
+class ParallelPdfLoader:
+    """
+    Loads a PDF by splitting it into page ranges that are extracted in a process pool.
+    Pages are yielded in document order with their zero-based page number, as PyPDFLoader numbers them,
+    and only a bounded number of ranges are in flight at a time so memory stays independent of the document size.
+    """
+    def __init__(self, executor, pages_per_task: int = 8, max_in_flight: int = 8):
+        self.executor = executor
+        self.pages_per_task = pages_per_task
+        self.max_in_flight = max_in_flight
+
+    def lazy_load(self, path: str):
+        """
+        Yields: (page number, page text) tuples in page order.
+        """
+        total_pages = count_pages(path)
+        ranges = iter(
+            (start, min(start + self.pages_per_task, total_pages))
+            for start in range(0, total_pages, self.pages_per_task)
+        )
+        in_flight = deque()
+
+        def submit_next():
+            page_range = next(ranges, None)
+            if page_range is not None:
+                in_flight.append((page_range[0], self.executor.submit(extract_page_range, path, *page_range)))
+
+        for _ in range(self.max_in_flight):
+            submit_next()
+        while in_flight:
+            start, future = in_flight.popleft()
+            texts = future.result()
+            submit_next()
+            for offset, text in enumerate(texts):
+                yield start + offset, text
@@ -0,0 +1,276 @@
+import logging
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import time
+from contextlib import contextmanager
+import httpx
+from config import (
+    EMBEDDING_MODEL,
+    OLLAMA_URL,
+    OLLAMA_MODEL,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_TIMEOUT,
+    LLM_MAX_IN_FLIGHT,
+    LLM_MAX_QUEUE,
+    LLM_QUEUE_TIMEOUT,
+    CHROMA_HOST,
+    CHROMA_PORT,
+    CHROMA_MODE,
+    COLLECTION_NAME,
+    DATA_DIR,
+    CHUNK_INDEX_PATH,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_CACHE_MEMORY_ENTRIES,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_SIMILARITY,
+    PDF_PARSE_WORKERS,
+    PDF_PAGES_PER_TASK,
+    LOCAL_INDEX_ENABLED,
+    LOCAL_INDEX_DIR,
+    QUERY_BATCH_WINDOW_MS,
+    QUERY_BATCH_MAX_SIZE,
+    API_WORKERS,
+    METRICS_DB_PATH,
+    METRICS_FLUSH_INTERVAL,
+)
+from rag.batcher import QueryBatcher
+from rag.llm_gateway import LLMGateway
+from rag.local_index import LocalVectorIndex
+from rag.file_lock import FileLockHeld
+from rag.pdf_parsing import ParallelPdfLoader
+from rag.answer_cache import AnswerCache
+from rag.chunk_index import ChunkIndex
+from rag.metrics import MetricsRegistry, SqliteMetricsStore, BufferedMetricsStore
+from rag.token_accounting import TokenAccountant, get_encoding
+
+logger = logging.getLogger(__name__)
+
+
+def create_metrics_registry() -> MetricsRegistry:
+    """
+    With several API workers the metrics live in a SQLite store they all share, so /stats covers every worker.
+    Each worker counts in memory and merges its counts into the store every METRICS_FLUSH_INTERVAL seconds.
+    """
+    if API_WORKERS > 1:
+        # Buffered, so requests never wait on the database lock the workers share.
+        return MetricsRegistry(BufferedMetricsStore(SqliteMetricsStore(METRICS_DB_PATH), METRICS_FLUSH_INTERVAL))
+    return MetricsRegistry()
+
+
+def metadata_filter(source=None, page=None):
+    """
+    Build the Chroma `where` filter restricting a search to some sources (filenames) and/or pages.
+    Each argument is a single value or a non-empty list of accepted values.
+    Returns: the filter dict, or None when there is nothing to filter on.
+    Raises ValueError for an empty list, which Chroma rejects.
+    """
+    conditions = []
+    for key, value in (("source", source), ("page", page)):
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            if not value:
+                raise ValueError(f"The {key} filter needs at least one value.")
+            conditions.append({key: {"$in": list(value)}})
+        else:
+            conditions.append({key: value})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+class SharedResources:
+    """
+    Process-wide holder for the expensive clients used by the RAG pipeline.
+    The embedding model, the Chroma client/collection and the Ollama client are built once
+    and injected into every Retrivial and DocumentIngestor instead of being rebuilt per request.
+    """
+    def __init__(self, metrics: MetricsRegistry = None):
+        # The heavy client libraries are imported here rather than at module level, so importing the
+        # app stays fast and the cost is paid (and timed) while the resources are built.
+        import chromadb
+        from chromadb.config import Settings
+        from langchain_chroma import Chroma
+        from langchain_ollama import OllamaLLM
+        from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
+        from rag.embedding_cache import CachedEmbeddings
+
+        os.makedirs(DATA_DIR, exist_ok=True)
+        # Seconds spent building each component, reported by /health/ready.
+        self.timings = {}
+        self.shared_metrics = API_WORKERS > 1
+        # The registry is closed (flushed) with these resources when they created it themselves.
+        self.owns_metrics = metrics is None
+        self.metrics = metrics if metrics is not None else create_metrics_registry()
+        # Number of collection changes seen by this worker (see refresh_if_index_changed).
+        self.index_version = self.metrics.get("rag_index_changes_total")
+        # Prompt/completion token totals per endpoint, from Ollama's own counts when it reports them.
+        self.tokens = TokenAccountant(self.metrics, OLLAMA_MODEL)
+        self.embedding_model_name = EMBEDDING_MODEL
+        with self.timed("embedding"):
+            # Every embedding call (ingestion and queries) goes through the disk-backed cache.
+            self.embedding = CachedEmbeddings(
+                self.metrics,
+                SentenceTransformerEmbeddings(model_name=EMBEDDING_MODEL),
+                model_name=EMBEDDING_MODEL,
+                path=EMBEDDING_CACHE_PATH,
+                max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+                memory_entries=EMBEDDING_CACHE_MEMORY_ENTRIES,
+            )
+
+        with self.timed("chroma"):
+            if CHROMA_MODE == "ephemeral":
+                self.client = chromadb.EphemeralClient(settings=Settings(allow_reset=True))
+            else:
+                # The HttpClient keeps a pooled HTTP session to the chroma container for its whole lifetime.
+                self.client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, settings=Settings(allow_reset=True))
+            self.collection = self.client.get_or_create_collection(COLLECTION_NAME)
+            self.vs = Chroma(client=self.client, collection_name=COLLECTION_NAME, embedding_function=self.embedding)
+
+            self.chunk_index = ChunkIndex(CHUNK_INDEX_PATH)
+            self.chunk_index.sync_from_collection(self.collection)
+
+            self.local_index = None
+            if LOCAL_INDEX_ENABLED and self.shared_metrics:
+                # The mirror's row allocation is private to a process, so workers cannot write to it concurrently.
+                logger.warning("LOCAL_INDEX_ENABLED is ignored with API_WORKERS > 1")
+            elif LOCAL_INDEX_ENABLED:
+                try:
+                    self.local_index = LocalVectorIndex(LOCAL_INDEX_DIR)
+                except FileLockHeld as e:
+                    # Another process owns the mirror; searches go to Chroma instead.
+                    logger.warning(f"Local index not used: {e}")
+                else:
+                    self.local_index.sync_from_collection(self.collection)
+
+        self.batcher = None
+        if QUERY_BATCH_MAX_SIZE > 1:
+            self.batcher = QueryBatcher(self, window=QUERY_BATCH_WINDOW_MS / 1000, max_batch_size=QUERY_BATCH_MAX_SIZE)
+
+        self.answer_cache = AnswerCache(
+            self.metrics,
+            self.embedding,
+            max_entries=ANSWER_CACHE_MAX_ENTRIES,
+            ttl=ANSWER_CACHE_TTL,
+            similarity_threshold=ANSWER_CACHE_SIMILARITY,
+        )
+
+        self.parse_pool = None
+        self.pdf_loader = None
+        if PDF_PARSE_WORKERS > 0:
+            # Spawned (not forked) workers, since the parent already runs threads and holds the embedding model.
+            self.parse_pool = ProcessPoolExecutor(
+                max_workers=PDF_PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+            self.pdf_loader = ParallelPdfLoader(
+                self.parse_pool, pages_per_task=PDF_PAGES_PER_TASK, max_in_flight=2 * PDF_PARSE_WORKERS
+            )
+
+        # One pooled, keep-alive HTTP client per direction (sync/async) is reused by every generation.
+        self.llm = OllamaLLM(
+            base_url=OLLAMA_URL,
+            model=OLLAMA_MODEL,
+            temperature=0.1,
+            keep_alive=OLLAMA_KEEP_ALIVE,
+            client_kwargs={
+                "timeout": OLLAMA_TIMEOUT,
+                "limits": httpx.Limits(
+                    max_connections=LLM_MAX_IN_FLIGHT + 4,
+                    max_keepalive_connections=LLM_MAX_IN_FLIGHT + 4,
+                    keepalive_expiry=300,
+                ),
+            },
+        )
+        self.gateway = LLMGateway(
+            self.metrics, max_in_flight=LLM_MAX_IN_FLIGHT, max_queue=LLM_MAX_QUEUE, queue_timeout=LLM_QUEUE_TIMEOUT
+        )
+
+    @contextmanager
+    def timed(self, component: str):
+        started = time.perf_counter()
+        yield
+        self.timings[component] = self.timings.get(component, 0.0) + time.perf_counter() - started
+
+    def warm_up_embedding(self):
+        """Run the embedding model once, bypassing the cache, so its first real use is not slowed down by lazy initialisation."""
+        with self.timed("embedding"):
+            self.embedding.embedding.embed_query("warm up")
+
+    def warm_up_tokenizer(self):
+        """Load the tiktoken encoding used for the token count fallback and the context budget."""
+        with self.timed("tokenizer"):
+            get_encoding(OLLAMA_MODEL).encode("warm up")
+
+    def warm_up_chroma(self):
+        with self.timed("chroma"):
+            self.client.heartbeat()
+
+    def warm_up_ollama(self):
+        """Generate a single token, which makes Ollama load the model and keep it loaded for OLLAMA_KEEP_ALIVE."""
+        with self.timed("ollama"):
+            self.llm.invoke("Hi", options={"num_predict": 1})
+
+    def search_by_vectors(self, embeddings: list[list[float]], k: int = 5, where: dict = None):
+        """
+        Run a similarity search for several query embeddings at once: one multi-query Chroma call,
+        or the in-process index when it is enabled.
+        Args: where : dict, a metadata filter (see metadata_filter) applied inside the search, so only
+        the matching chunks are compared with the queries.
+        Returns: one list of (Document, distance) tuples per query embedding, nearest first.
+        """
+        if self.local_index is not None:
+            return [self.local_index.search(embedding, k, where) for embedding in embeddings]
+        from langchain.schema.document import Document
+        results = self.collection.query(
+            query_embeddings=embeddings, n_results=k, where=where, include=["documents", "metadatas", "distances"]
+        )
+        return [
+            [
+                (Document(page_content=document, metadata={**(metadata or {}), "id": chunk_id}), distance)
+                for chunk_id, document, metadata, distance in zip(ids, documents, metadatas, distances)
+            ]
+            for ids, documents, metadatas, distances in zip(
+                results["ids"], results["documents"], results["metadatas"], results["distances"]
+            )
+        ]
+
+    def embed_and_search(self, queries: list[str], k: int = 5, where: dict = None, return_embeddings: bool = False):
+        """
+        Embed several queries with one encode call and search them with one multi-query call.
+        Returns: one list of (Document, distance) tuples per query, nearest first; with return_embeddings,
+        a (results, query embeddings) tuple, e.g. for the near-duplicate lookup of the answer cache.
+        """
+        with self.metrics.timer("rag_stage_duration_seconds", pipeline="generate", stage="embed_query"):
+            embeddings = self.embedding.embed_documents(queries)
+        with self.metrics.timer("rag_stage_duration_seconds", pipeline="generate", stage="search"):
+            results = self.search_by_vectors(embeddings, k, where)
+        return (results, embeddings) if return_embeddings else results
+
+    def mark_index_changed(self):
+        """Tell the other API workers that the collection changed (ingestion or clear)."""
+        self.metrics.inc("rag_index_changes_total")
+
+    def refresh_if_index_changed(self):
+        """
+        Drop the per-process answer cache when another worker changed the collection since the last check.
+        Only needed with several API workers; a single worker invalidates its cache directly.
+        """
+        if not self.shared_metrics:
+            return
+        version = self.metrics.get("rag_index_changes_total")
+        if version != self.index_version:
+            self.index_version = version
+            self.answer_cache.invalidate()
+
+    def close(self):
+        """Shut down the worker processes owned by these resources and flush their metrics and embedding cache."""
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown(cancel_futures=True)
+        self.embedding.close()
+        if self.local_index is not None:
+            self.local_index.close()
+        if self.owns_metrics:
+            self.metrics.close()
@@ -1,37 +1,16 @@
-from langchain.prompts import PromptTemplate
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaLLM
-import tiktoken
-import chromadb
-from chromadb.config import Settings
-from langchain_community.embeddings.sentence_transformer import (
-    SentenceTransformerEmbeddings,
-)
-def robust_count_tokens(text: str, model: str = "llama3.2:1b"):
-    """
-    Count tokens in a given text using tiktoken.
-    Tries to use the model-specific encoding and falls back to a default encoding if necessary.
-    
-    Args:
-        text (str): The text to count tokens for.
-        model (str): The name of the model to determine the encoding.
-        
-    Returns:
-        int: The number of tokens in the text.
-    """
-    try:
-        # Try to get encoding for the specified model.
-        encoding = tiktoken.encoding_for_model(model)
-    except Exception:
-        # Fallback to a default encoding if the model-specific encoding is unavailable.
-        encoding = tiktoken.get_encoding("cl100k_base")
-    return len(encoding.encode(text))
+from rag.context_packing import ContextPacker
+from rag.token_accounting import usage_callback
+from config import CONTEXT_TOKEN_BUDGET, RETRIEVAL_MAX_DISTANCE, CONTEXT_DUPLICATE_THRESHOLD
+import asyncio
+
+# Answer returned without calling the LLM when no retrieved chunk is relevant enough.
+NO_CONTEXT_RESPONSE = "The provided documents do not contain enough information to answer this question."
 
 class Retrivial:
     """
     Class that handle the retrivial, augmentation, and generation process for the question answering task
     """
-    def __init__(self,query):
+    def __init__(self,query,resources,where=None):
         self.PROMPT_TEMPLATE = """
 You are a technical documentation assistant.
 Your task is to answer the following question using only the information provided in the context.
@@ -47,14 +26,58 @@ Question: {question}
 Answer (with citations): 
 """
         self.query = "what is the objective of the game?" if query is None else query 
-        self.embedding = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
-        client = chromadb.HttpClient(host="chroma", port=8000, settings=Settings(allow_reset=True))
-
-        self.db = Chroma(client=client, collection_name="my_collection", embedding_function = self.embedding )
+        # Embedding model, vector store and LLM are shared process-wide (see rag.resources).
+        self.resources = resources
+        self.embedding = resources.embedding
+        self.llm = resources.llm
+        # Admission control for generations made from the API (see rag.llm_gateway).
+        self.gateway = resources.gateway
+        self.metrics = resources.metrics
+        self.tokens = resources.tokens
+        # Micro-batcher shared by concurrent requests, None when batching is disabled.
+        self.batcher = resources.batcher
+        self.k = 5
+        # Metadata filter applied inside the similarity search (see rag.resources.metadata_filter).
+        self.where = where
+        self.sources = []
+        # Embedding of the query, set by the retrieval (see AnswerCache.lookup_similar).
+        self.query_embedding = None
+        self.packer = ContextPacker(
+            self.tokens.count,
+            token_budget=CONTEXT_TOKEN_BUDGET,
+            max_distance=RETRIEVAL_MAX_DISTANCE,
+            duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD,
+        )
+        self.packing_stats = {}
+        # Prompt and completion tokens of the last generation (see rag.token_accounting).
+        self.usage = {"prompt_tokens": 0, "completion_tokens": 0, "source": None}
     def find_relevant_docs(self):
         """ Find the relevant documents based on the query"""
-        relevant_docs = self.db.similarity_search_with_score(self.query,k= 5)
+        with self.stage("embed_query"):
+            self.query_embedding = self.embedding.embed_query(self.query)
+        with self.stage("search"):
+            relevant_docs = self.resources.search_by_vectors([self.query_embedding],k= self.k,where= self.where)[0]
         return relevant_docs
+    async def afind_relevant_docs(self):
+        """Find the relevant documents without blocking the event loop, batched with concurrent queries when possible."""
+        if self.batcher is not None:
+            relevant_docs, self.query_embedding = await self.batcher.search(self.query, k= self.k, where= self.where)
+            return relevant_docs
+        return await asyncio.to_thread(self.find_relevant_docs)
+    def stage(self, name: str):
+        """Time a stage of the generation pipeline (see rag.metrics)."""
+        return self.metrics.timer("rag_stage_duration_seconds", pipeline="generate", stage=name)
+    def count_tokens(self, text: str) -> int:
+        with self.stage("count_tokens"):
+            return self.tokens.count(text)
+    def resolve_usage(self, callback, prompt_formated: str, response_text: str) -> int:
+        """
+        Take the token counts reported by Ollama for the last generation, counting with tiktoken only when they are missing.
+        Returns: token_len : int, the number of completion tokens
+        """
+        with self.stage("count_tokens"):
+            self.usage = self.tokens.usage(callback, prompt_formated, response_text)
+        return self.usage["completion_tokens"]
     def format_docs_with_id(self,docs) :
         """
         Format the documents with the source id
@@ -76,12 +99,42 @@ Answer (with citations):
         #     print(docs.metadata)
         #     print(score)
         #     print(docs.page_content)
-        formatted_context = self.format_docs_with_id(relevant_docs)
-        prompt_template = PromptTemplate.from_template(self.PROMPT_TEMPLATE)
-        prompt_formated = prompt_template.format(context = formatted_context,question  = self.query)
+        return self.build_prompt(relevant_docs)
+
+    async def aretrieve(self, relevant_docs=None):
+        """Async variant of retrieve(). Args: relevant_docs : the search results, when already retrieved."""
+        if relevant_docs is None:
+            relevant_docs = await self.afind_relevant_docs()
+        return await asyncio.to_thread(self.build_prompt, relevant_docs)
+
+    def build_prompt(self, relevant_docs):
+        """
+        Pack the retrieved documents into the token budget and format them into the prompt
+        Returns: prompt_formated : str (None when no document is relevant enough), formatted_context : str
+        """
+        with self.stage("pack"):
+            relevant_docs, self.packing_stats = self.packer.pack(
+                relevant_docs,
+                format_doc=lambda doc: f"Article Title: {doc.metadata['source']}\nArticle Snippet: {doc.page_content}",
+            )
+        if not relevant_docs:
+            self.sources = []
+            return None, ""
+
+        with self.stage("prompt_format"):
+            self.sources = [doc.metadata['source'] for doc, _ in relevant_docs]
+            formatted_context = self.format_docs_with_id(relevant_docs)
+            from langchain.prompts import PromptTemplate
+            prompt_template = PromptTemplate.from_template(self.PROMPT_TEMPLATE)
+            prompt_formated = prompt_template.format(context = formatted_context,question  = self.query)
        
         return prompt_formated,formatted_context
     
+    def skip_generation(self):
+        """Answer without calling the LLM, used when no retrieved chunk passed the relevance threshold."""
+        self.metrics.inc("rag_llm_skipped_total")
+        return NO_CONTEXT_RESPONSE
+
     def generate_response(self,prompt_formated : str):
         """
         generate response based on the prompt
@@ -89,12 +142,10 @@ Answer (with citations):
         Returns: response_text : str
 
         """
-        model = OllamaLLM(
-            base_url="http://ollama:11434/",
-    model="llama3.2:1b",
-    temperature=0.1,
-)
-        response_text =model.invoke(prompt_formated)
+        callback = usage_callback()
+        with self.stage("llm"):
+            response_text = self.llm.invoke(prompt_formated, config={"callbacks": [callback]})
+        self.resolve_usage(callback, prompt_formated, response_text)
         return response_text
     
     def run(self):
@@ -103,14 +154,69 @@ Answer (with citations):
         Returns: response_text : str, token_len : int
         """
         prompt_formated,formated_context = self.retrieve()
+        if prompt_formated is None:
+            return self.skip_generation(),formated_context,0
         response_text = self.generate_response(prompt_formated)
         print(response_text)
-        token_len = robust_count_tokens(response_text)
+        token_len = self.usage["completion_tokens"]
         return response_text,formated_context,token_len
+
+    async def arun(self, relevant_docs=None):
+        """
+        Async variant of run(). The similarity search is run in a worker thread (through the micro-batcher
+        when enabled) and the LLM is awaited through its async client, so the event loop is never blocked.
+        Args: relevant_docs : the search results, when already retrieved (see afind_relevant_docs)
+        Returns: response_text : str, formated_context : str, token_len : int
+        """
+        prompt_formated,formated_context = await self.aretrieve(relevant_docs)
+        if prompt_formated is None:
+            return self.skip_generation(),formated_context,0
+        response_text = await self.agenerate_response(prompt_formated)
+        return response_text,formated_context,self.usage["completion_tokens"]
+
+    async def agenerate_response(self, prompt_formated: str):
+        """
+        Async variant of generate_response(), holding an LLM gateway slot for the call.
+        Args: prompt_formated : str
+        Returns: response_text : str
+        """
+        callback = usage_callback()
+        async with self.gateway.slot():
+            with self.stage("llm"):
+                response_text = await self.llm.ainvoke(prompt_formated, config={"callbacks": [callback]})
+        self.resolve_usage(callback, prompt_formated, response_text)
+        return response_text
+
+    async def astream(self, retrieved: tuple = None):
+        """
+        Stream the answer as it is generated. The retrieved context is yielded first, so the
+        client gets the sources as soon as the retrieval finishes, then the LLM gateway slot is
+        taken (GatewayBusy when it cannot be) and the LLM tokens follow.
+        Args: retrieved : tuple, the result of aretrieve() when the caller already ran the retrieval
+        Yields: (event : str, data) tuples with event in "sources", "token" and "done".
+        """
+        prompt_formated,formated_context = retrieved if retrieved is not None else await self.aretrieve()
+        yield "sources", formated_context
+        if prompt_formated is None:
+            yield "token", self.skip_generation()
+            yield "done", 0
+            return
+
+        response_parts = []
+        callback = usage_callback()
+        async with self.gateway.slot():
+            with self.stage("llm"):
+                async for token in self.llm.astream(prompt_formated, config={"callbacks": [callback]}):
+                    response_parts.append(token)
+                    yield "token", token
+
+        token_len = self.resolve_usage(callback, prompt_formated, "".join(response_parts))
+        yield "done", token_len
     
     
 if __name__ == "__main__":    
-    retriever = Retrivial()
+    from rag.resources import SharedResources
+    retriever = Retrivial(None, SharedResources())
     retriever.run()
     
     
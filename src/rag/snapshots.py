@@ -0,0 +1,168 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+import numpy as np
+from rag.ingestion import DocumentIngestor
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.jsonl"
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot is missing, malformed or was made with another embedding model."""
+
+
+def export_snapshot(resources, path: str, page_size: int = 1000) -> dict:
+    """
+    Write the whole collection to a snapshot directory:
+    - manifest.json: format version, embedding model, number of chunks, dimension and the content hash of every source
+    - embeddings.npy: float16 matrix of the chunk embeddings, one row per chunk
+    - chunks.jsonl: id, text and metadata of every chunk, in the same order as the rows
+    The collection is read page by page and the matrix is written through a memory map, so memory stays bounded.
+    The snapshot is written next to path and moved into place once complete.
+
+    Returns: the manifest
+    """
+    if os.path.exists(path):
+        raise SnapshotError(f"Snapshot '{path}' already exists.")
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    total = resources.collection.count()
+    written, vectors = 0, None
+    try:
+        with open(os.path.join(tmp_path, CHUNKS_FILE), "w", encoding="utf-8") as chunks_file:
+            for offset in range(0, total, page_size):
+                page = resources.collection.get(
+                    include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset
+                )
+                embeddings = np.asarray(page["embeddings"], dtype=np.float16)
+                if not len(embeddings):
+                    break
+                if vectors is None:
+                    vectors = np.lib.format.open_memmap(
+                        os.path.join(tmp_path, EMBEDDINGS_FILE), mode="w+", dtype=np.float16, shape=(total, embeddings.shape[1])
+                    )
+                # The collection may shrink while it is exported; the manifest records how many rows are valid.
+                embeddings = embeddings[:total - written]
+                vectors[written:written + len(embeddings)] = embeddings
+                for chunk_id, document, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                    chunks_file.write(json.dumps({"id": chunk_id, "document": document, "metadata": metadata or {}}) + "\n")
+                written += len(embeddings)
+                logger.info(f"Exported {written}/{total} chunks")
+        if vectors is not None:
+            vectors.flush()
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "embedding_model": resources.embedding_model_name,
+            "count": written,
+            "dimension": 0 if vectors is None else int(vectors.shape[1]),
+            "dtype": "float16",
+            "created": time.time(),
+            "files": resources.chunk_index.file_hashes(),
+        }
+        del vectors
+        with open(os.path.join(tmp_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return manifest
+
+
+def read_manifest(path: str) -> dict:
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise SnapshotError(f"No snapshot found at '{path}'.")
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"Unsupported snapshot format {manifest.get('format')}.")
+    return manifest
+
+
+def import_snapshot(resources, path: str, batch_size: int = 5000) -> dict:
+    """
+    Load a snapshot into the collection without re-embedding anything. Chunks are upserted in batches of
+    batch_size, reading the embeddings through a memory map and the chunks line by line, and are added to the
+    chunk index (and the local index when enabled) like freshly ingested ones. Every source in the snapshot is
+    then replaced by its snapshot version: its stored chunks that are not part of the snapshot (e.g. of a later
+    version of the file) are deleted. Sources that are not in the snapshot are kept.
+    Raises SnapshotError when the snapshot was made with a different embedding model.
+
+    Returns: dict with the number of imported and removed chunks and the snapshot's embedding model
+    """
+    manifest = read_manifest(path)
+    if manifest["embedding_model"] != resources.embedding_model_name:
+        raise SnapshotError(
+            f"Snapshot was made with the embedding model '{manifest['embedding_model']}', "
+            f"but this service uses '{resources.embedding_model_name}'."
+        )
+    from langchain.schema.document import Document
+    ingestor = DocumentIngestor(resources)
+    imported = 0
+    # Chunk ids of the snapshot per source.
+    snapshot_ids = {source: set() for source in manifest.get("files", {})}
+    if manifest["count"]:
+        vectors = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        with open(os.path.join(path, CHUNKS_FILE), encoding="utf-8") as chunks_file:
+            batch = []
+            for line in chunks_file:
+                if imported + len(batch) == manifest["count"]:
+                    break
+                chunk = json.loads(line)
+                snapshot_ids.setdefault(chunk["metadata"].get("source"), set()).add(chunk["id"])
+                batch.append(Document(page_content=chunk["document"], metadata={**chunk["metadata"], "id": chunk["id"]}))
+                if len(batch) == batch_size:
+                    ingestor.upsert_batch(batch, vectors[imported:imported + len(batch)].astype(np.float32).tolist())
+                    imported += len(batch)
+                    batch = []
+                    logger.info(f"Imported {imported}/{manifest['count']} chunks")
+            if batch:
+                ingestor.upsert_batch(batch, vectors[imported:imported + len(batch)].astype(np.float32).tolist())
+                imported += len(batch)
+        del vectors
+    # Deleted after the upserts, so the collection never misses a source while the import runs.
+    removed = sum(ingestor.remove_stale_chunks(source, ids) for source, ids in snapshot_ids.items() if source is not None)
+    # Re-uploading an unchanged file is then recognised as such (see DocumentIngestor.run_from_path).
+    for source, sha256 in manifest.get("files", {}).items():
+        resources.chunk_index.set_file_hash(source, sha256)
+    logger.info(f"Imported {imported} chunks from '{path}', removed {removed} chunks they replace")
+    return {"imported": imported, "removed": removed, "embedding_model": manifest["embedding_model"]}
+
+
+if __name__ == "__main__":
+    from rag.file_lock import FileLock, FileLockHeld
+    from rag.resources import SharedResources
+    from config import SNAPSHOT_BATCH_SIZE, API_LOCK_PATH
+
+    parser = argparse.ArgumentParser(description="Export the vector collection to a snapshot, or import one without re-embedding.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="snapshot directory")
+    parser.add_argument("--batch-size", type=int, default=SNAPSHOT_BATCH_SIZE, help="chunks per upsert when importing")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "import":
+        # A running API would keep serving its answer cache and local index from before the import.
+        try:
+            api_lock = FileLock(API_LOCK_PATH).acquire()
+        except FileLockHeld:
+            parser.exit(1, "The API is running: import with POST /admin/snapshots/{name}/import instead.\n")
+    resources = SharedResources()
+    try:
+        if args.command == "export":
+            print(json.dumps({key: value for key, value in export_snapshot(resources, args.path).items() if key != "files"}))
+        else:
+            print(json.dumps(import_snapshot(resources, args.path, batch_size=args.batch_size)))
+    finally:
+        resources.close()
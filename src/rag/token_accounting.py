@@ -0,0 +1,85 @@
+from functools import lru_cache
+from rag.metrics import parse_series_key
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """Look up the tiktoken encoding of a model once per process."""
+    import tiktoken
+    try:
+        # Try to get encoding for the specified model.
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        # Fallback to a default encoding if the model-specific encoding is unavailable.
+        return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=None)
+def usage_callback_class():
+    """
+    Define the usage callback on first use, so that langchain_core is not imported when the app is.
+    Returns: OllamaUsageCallback, a BaseCallbackHandler that captures the token counts Ollama reports
+    with the final chunk of a generation (prompt_eval_count and eval_count), for invoke and stream calls alike.
+    """
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class OllamaUsageCallback(BaseCallbackHandler):
+        def __init__(self):
+            self.prompt_tokens = None
+            self.completion_tokens = None
+
+        def on_llm_end(self, response, **kwargs):
+            info = response.generations[0][0].generation_info or {}
+            self.prompt_tokens = info.get("prompt_eval_count")
+            self.completion_tokens = info.get("eval_count")
+
+    return OllamaUsageCallback
+
+
+def usage_callback():
+    """Returns: a new OllamaUsageCallback for one generation."""
+    return usage_callback_class()()
+
+
+class TokenAccountant:
+    """
+    Token accounting for prompts and completions. The counts reported by Ollama are used when present;
+    tiktoken, with its encoder cached per process, is only the fallback when they are missing.
+    Totals are kept per endpoint in the metrics registry.
+    """
+    def __init__(self, metrics, model: str):
+        self.metrics = metrics
+        self.model = model
+
+    def count(self, text: str) -> int:
+        return len(get_encoding(self.model).encode(text))
+
+    def usage(self, callback, prompt: str, completion: str) -> dict:
+        """
+        Resolve the prompt and completion token counts of one generation.
+        Returns: dict with "prompt_tokens", "completion_tokens" and "source" ("ollama" or "tiktoken").
+        """
+        prompt_tokens, completion_tokens = callback.prompt_tokens, callback.completion_tokens
+        source = "ollama"
+        if prompt_tokens is None or completion_tokens is None:
+            source = "tiktoken"
+            self.metrics.inc("rag_token_count_fallbacks_total")
+            if prompt_tokens is None:
+                prompt_tokens = self.count(prompt)
+            if completion_tokens is None:
+                completion_tokens = self.count(completion)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "source": source}
+
+    def record(self, endpoint: str, usage: dict):
+        self.metrics.inc("rag_tokens_total", {"endpoint": endpoint, "kind": "prompt"}, usage["prompt_tokens"])
+        self.metrics.inc("rag_tokens_total", {"endpoint": endpoint, "kind": "completion"}, usage["completion_tokens"])
+
+    def stats(self) -> dict:
+        """Returns: dict of endpoint -> {"prompt": int, "completion": int}."""
+        stats = {}
+        for key, value in self.metrics.store.snapshot().items():
+            name, labels = parse_series_key(key)
+            if name != "rag_tokens_total":
+                continue
+            stats.setdefault(labels["endpoint"], {"prompt": 0, "completion": 0})[labels["kind"]] = int(value)
+        return stats
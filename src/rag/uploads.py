@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import os
+import uuid
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+    from python_multipart.exceptions import MultipartParseError
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+    from multipart.exceptions import MultipartParseError
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class InvalidUpload(Exception):
+    """The request body is not a well-formed multipart/form-data upload."""
+
+
+class SpooledUpload:
+    """A file part of a multipart upload, written to disk while it was received."""
+    def __init__(self, filename: str, content_type: str, path: str):
+        self.filename = filename
+        self.content_type = content_type
+        self.path = path
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.file = open(path, "wb")
+
+    @property
+    def sha256(self) -> str:
+        return self.digest.hexdigest()
+
+
+class MultipartSpooler:
+    """
+    Callbacks of the streaming multipart parser. The file parts of the accepted fields are hashed and written
+    straight to their own file in directory as their bytes arrive, and rejected as soon as one grows past
+    max_bytes; every other part is skipped without being buffered. max_files and max_total_bytes, when given,
+    cap the number of files and their combined size the same way.
+    validate, when given, is called with (filename, content_type) when a file part starts and may raise.
+    """
+    def __init__(self, directory: str, fields: set, max_bytes: int, validate=None, max_files: int = None,
+                 max_total_bytes: int = None):
+        self.directory = directory
+        self.fields = fields
+        self.max_bytes = max_bytes
+        self.validate = validate
+        self.max_files = max_files
+        self.max_total_bytes = max_total_bytes
+        self.total_bytes = 0
+        self.uploads = []
+        self.current = None
+        self.headers = {}
+        self.header_field = b""
+        self.header_value = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self.headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b""
+        self.header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if name not in self.fields or b"filename" not in options:
+            return
+        filename = options[b"filename"].decode("utf-8", "replace")
+        content_type = self.headers.get(b"content-type", b"").decode("latin-1")
+        if self.max_files and len(self.uploads) >= self.max_files:
+            raise InvalidUpload(f"At most {self.max_files} files can be uploaded at once.")
+        if self.validate is not None:
+            self.validate(filename, content_type)
+        path = os.path.join(self.directory, f"{uuid.uuid4().hex}_{os.path.basename(filename)}")
+        self.current = SpooledUpload(filename, content_type, path)
+        self.uploads.append(self.current)
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self.current is None:
+            return
+        chunk = data[start:end]
+        self.current.size += len(chunk)
+        self.total_bytes += len(chunk)
+        if self.max_bytes and self.current.size > self.max_bytes:
+            raise UploadTooLarge(f"'{self.current.filename}' is larger than {self.max_bytes} bytes.")
+        if self.max_total_bytes and self.total_bytes > self.max_total_bytes:
+            raise UploadTooLarge(f"The uploaded files are larger than {self.max_total_bytes} bytes in total.")
+        self.current.digest.update(chunk)
+        self.current.file.write(chunk)
+
+    def on_part_end(self):
+        if self.current is not None:
+            self.current.file.close()
+            self.current = None
+
+    def discard(self):
+        """Remove every file written so far."""
+        for upload in self.uploads:
+            upload.file.close()
+            if os.path.exists(upload.path):
+                os.remove(upload.path)
+
+
+async def receive_uploads(request, directory: str, fields: set, max_bytes: int, validate=None, max_files: int = None,
+                          max_total_bytes: int = None) -> list[SpooledUpload]:
+    """
+    Parse a multipart/form-data request body as it is received from request.stream(), so an upload is
+    written to disk exactly once and a file over max_bytes is rejected before the rest of it is read.
+    Chunked requests without a Content-Length are capped the same way, as are the number of files
+    (max_files) and their total size (max_total_bytes).
+
+    Returns: the SpooledUpload of every file sent in one of the given form fields, in request order.
+    Raises: InvalidUpload, UploadTooLarge, or whatever validate raises; the spooled files are removed then.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise InvalidUpload("Expected a multipart/form-data body.")
+    spooler = MultipartSpooler(directory, fields, max_bytes, validate, max_files, max_total_bytes)
+    parser = MultipartParser(params[b"boundary"], spooler.callbacks())
+    try:
+        async for chunk in request.stream():
+            # The callbacks write to disk, so the parser runs off the event loop.
+            await asyncio.to_thread(parser.write, chunk)
+        parser.finalize()
+    except MultipartParseError as e:
+        spooler.discard()
+        raise InvalidUpload(f"Malformed multipart body: {e}")
+    except BaseException:
+        spooler.discard()
+        raise
+    if spooler.current is not None:
+        spooler.discard()
+        raise InvalidUpload("The multipart body ended in the middle of a file.")
+    return spooler.uploads
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app runs with src on the path (modules import each other as rag.x and config).
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip("langchain")
+from langchain.schema.document import Document
+from rag.context_packing import ContextPacker
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def doc(text: str, source: str = "manual.pdf") -> Document:
+    return Document(page_content=text, metadata={"source": source})
+
+
+def test_near_duplicates_are_dropped():
+    text = "Each player is given fifteen hundred dollars divided into bills of several denominations by the banker"
+    packer = ContextPacker(count_words, token_budget=1000)
+    packed, stats = packer.pack([(doc(text), 0.2), (doc(text.replace("banker", "bank")), 0.4), (doc("Roll both dice to move."), 0.5)])
+    assert [item.page_content for item, _ in packed] == [text, "Roll both dice to move."]
+    assert stats["candidates"] == 3 and stats["kept"] == 2
+
+
+def test_overlap_with_a_kept_chunk_is_trimmed():
+    first = "The banker also keeps the title deed cards and the houses and hotels before the game starts."
+    second = "the houses and hotels before the game starts. Players then roll the dice in turn."
+    packer = ContextPacker(count_words, token_budget=1000, min_overlap=10)
+    packed, _ = packer.pack([(doc(first), 0.1), (doc(second), 0.2)])
+    assert packed[1][0].page_content == "Players then roll the dice in turn."
+
+
+def test_chunks_are_ordered_and_filtered_by_distance():
+    packer = ContextPacker(count_words, token_budget=1000, max_distance=1.0)
+    packed, _ = packer.pack([(doc("far away chunk"), 1.5), (doc("second best"), 0.6), (doc("best match"), 0.3)])
+    assert [item.page_content for item, _ in packed] == ["best match", "second best"]
+
+
+def test_token_budget_is_respected():
+    docs = [(doc("one two three four"), 0.1), (doc("five six seven eight nine ten"), 0.2), (doc("eleven twelve"), 0.3)]
+    packer = ContextPacker(count_words, token_budget=6)
+    packed, stats = packer.pack(docs)
+    # The second chunk does not fit next to the first one, the smaller third one does.
+    assert [item.page_content for item, _ in packed] == ["one two three four", "eleven twelve"]
+    assert stats["tokens_before"] == 12
+    assert stats["tokens_after"] == 6
+    assert stats["tokens_saved"] == 6
+    assert sum(count_words(item.page_content) for item, _ in packed) <= packer.token_budget
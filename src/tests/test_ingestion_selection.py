@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+from rag.chunk_index import ChunkIndex
+from rag.ingestion import DocumentIngestor
+
+
+class FakeVectorStore:
+    def __init__(self):
+        self.deleted = []
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+
+
+def chunk(chunk_id: str, source: str = "manual.pdf"):
+    return SimpleNamespace(page_content=chunk_id, metadata={"id": chunk_id, "source": source})
+
+
+def make_ingestor(tmp_path) -> DocumentIngestor:
+    # Only the attributes used by the selection logic; __init__ would load the LangChain splitters.
+    ingestor = DocumentIngestor.__new__(DocumentIngestor)
+    ingestor.chunk_index = ChunkIndex(str(tmp_path / "chunks.sqlite3"))
+    ingestor.vs = FakeVectorStore()
+    ingestor.local_index = None
+    return ingestor
+
+
+def test_stored_and_repeated_chunks_are_skipped(tmp_path):
+    ingestor = make_ingestor(tmp_path)
+    ingestor.chunk_index.add(["a"], ["manual.pdf"])
+    seen_ids = set()
+    new_chunks, skipped = ingestor.select_new_chunks([chunk("a"), chunk("b"), chunk("b"), chunk("c")], seen_ids)
+    assert [item.metadata["id"] for item in new_chunks] == ["b", "c"]
+    assert skipped == 2
+    assert seen_ids == {"a", "b", "c"}
+
+    # A later batch of the same ingestion skips what the earlier ones already handled.
+    new_chunks, skipped = ingestor.select_new_chunks([chunk("c"), chunk("d")], seen_ids)
+    assert [item.metadata["id"] for item in new_chunks] == ["d"]
+    assert skipped == 1
+
+
+def test_chunks_missing_from_the_latest_upload_are_removed(tmp_path):
+    ingestor = make_ingestor(tmp_path)
+    ingestor.chunk_index.add(["a", "b", "c"], ["manual.pdf"] * 3)
+    ingestor.chunk_index.add(["x"], ["other.pdf"])
+    removed = ingestor.remove_stale_chunks("manual.pdf", {"a", "c", "d"})
+    assert removed == 1
+    assert ingestor.vs.deleted == ["b"]
+    assert ingestor.chunk_index.ids_for_source("manual.pdf") == {"a", "c"}
+    assert ingestor.chunk_index.ids_for_source("other.pdf") == {"x"}
+    assert ingestor.remove_stale_chunks("manual.pdf", {"a", "c"}) == 0
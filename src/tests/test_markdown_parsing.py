@@ -0,0 +1,55 @@
+from rag.markdown_parsing import iter_markdown_sections
+
+
+def parse(tmp_path, text: str, newline: str = "\n"):
+    path = tmp_path / "doc.md"
+    path.write_bytes(text.replace("\n", newline).encode("utf-8"))
+    with open(path, encoding="utf-8", newline="") as f:
+        source = f.read()
+    return source, list(iter_markdown_sections(str(path)))
+
+
+def test_headings_inside_fences_are_ignored(tmp_path):
+    _, sections = parse(tmp_path, (
+        "# Setup\n\nInstall it.\n\n"
+        "```bash\n# not a heading\nmake install\n```\n\n"
+        "~~~\n## still code\n~~~\n\n"
+        "## Usage\n\nRun it.\n"
+    ))
+    assert [section.path for section in sections] == [["Setup"], ["Setup", "Usage"]]
+    assert "# not a heading" in sections[0].text
+    assert "## still code" in sections[0].text
+
+
+def test_setext_headings_and_thematic_breaks(tmp_path):
+    _, sections = parse(tmp_path, (
+        "Title\n=====\n\nIntro.\n\n"
+        "Subtitle\n--------\n\nFirst part.\n\n---\n\nSecond part.\n"
+    ))
+    assert [section.path for section in sections] == [["Title"], ["Title", "Subtitle"]]
+    # A "---" after a blank line is a thematic break, not the underline of a heading.
+    assert "---\n\nSecond part." in sections[1].text
+
+
+def test_list_item_is_not_a_setext_title(tmp_path):
+    _, sections = parse(tmp_path, "# Notes\n\n- item\n---\n\nMore.\n")
+    assert [section.path for section in sections] == [["Notes"]]
+
+
+def test_heading_only_section_is_merged_into_the_next(tmp_path):
+    _, sections = parse(tmp_path, "# Guide\n\n## Install\n\nSteps.\n")
+    assert len(sections) == 1
+    assert sections[0].path == ["Guide", "Install"]
+    assert sections[0].text.startswith("# Guide")
+
+
+def test_offsets_round_trip_to_the_source(tmp_path):
+    for newline in ("\n", "\r\n"):
+        source, sections = parse(tmp_path, (
+            "Preamble with ünïcode.\n\n# One\n\nText of one.\n\n"
+            "```\n# fenced\n```\n\nTwo\n---\n\nText of two.\n\n### Three ###\n\nLast.\n"
+        ), newline)
+        assert sections[0].path == []
+        for section in sections:
+            assert source[section.start:section.end] == section.text
+        assert "".join(section.text for section in sections) == source